@@ -0,0 +1,157 @@
+"""
+The temporal part of the pipeline (see pipeline.txt) for one model: the state
+transition graph, naive CAT pretraces and regex pretraces of every method.
+"""
+
+import array
+import concurrent.futures
+import dataclasses
+
+import cats
+import graph
+import graphfile
+import instrument
+import regex
+
+
+@dataclasses.dataclass
+class Pretrace:
+    regex: regex.Regex
+    simplified: regex.Regex
+    must_contain: set
+    last_calls: set
+    # True if edge labels exceeding the size budget were over-approximated,
+    # so that the regex may allow more call sequences than the graph
+    approximate: bool = False
+
+
+@dataclasses.dataclass
+class Analysis:
+    model: tuple
+    graph: dict
+    cats: dict[str, cats.CatNode]
+    # None for methods that can never be called
+    pretraces: dict[str, Pretrace | None]
+
+
+def pretrace(g, initial_state, method, reachable=None,
+             **options) -> Pretrace | None:
+    """
+    Return the regex pretrace of `method` and its post-processed forms, or
+    None if no prestate of `method` is reachable from `initial_state`.
+
+    `reachable` are the states reachable from `initial_state`, computed if not
+    given. `options` are passed on to `regex.from_graph`. With a `budget`, the
+    result is marked `approximate` if any edge label exceeded it.
+    """
+    if reachable is None:
+        reachable = graph.reachable(g, [initial_state])
+    if not any(method in g.get(state, {}) for state in reachable):
+        return None
+    approximated = []
+    if options.get('budget') is not None:
+        approximated = options.setdefault('approximated', [])
+    before = len(approximated)
+    r = regex.from_graph(g, initial_state, method, **options)
+    with instrument.stage('simplification'):
+        result = Pretrace(
+                r,
+                regex.collapse_same_prefix(
+                        regex.factor_alternations(regex.prune_subsumed(r))),
+                regex.must_contain(r),
+                regex.last_calls(r),
+                len(approximated) > before)
+    if instrument.enabled():
+        instrument.count('regex_nodes_before', regex.size(result.regex))
+        instrument.count('regex_nodes_after', regex.size(result.simplified))
+    return result
+
+
+def encode_graph(g):
+    """
+    Return `g` in a compact form for sending it to other processes: the
+    tables of states and methods and a flat array of (prestate, method,
+    poststate) index triples.
+    """
+    states, methods = {}, {}
+    edges = array.array('I')
+    for pre, transitions in g.items():
+        for method, posts in transitions.items():
+            for post in posts:
+                edges.extend((states.setdefault(pre, len(states)),
+                              methods.setdefault(method, len(methods)),
+                              states.setdefault(post, len(states))))
+    return list(states), list(methods), edges
+
+
+def decode_graph(encoded):
+    """Inverse of `encode_graph`."""
+    states, methods, edges = encoded
+    g = {}
+    for i in range(0, len(edges), 3):
+        pre, method, post = edges[i : i + 3]
+        g.setdefault(states[pre], {}).setdefault(
+                methods[method], []).append(states[post])
+    return g
+
+
+# state of a worker process of `parallel_pretraces`
+_worker = None
+
+
+def _init_worker(shared, initial_state, options):
+    global _worker
+    if isinstance(shared, str):
+        g = graphfile.GraphFile(shared)
+    else:
+        g = decode_graph(shared)
+    _worker = (g, initial_state, graph.reachable(g, [initial_state]),
+               regex.shared_options(g, initial_state, options))
+
+
+def _worker_pretrace(method):
+    g, initial_state, reachable, options = _worker
+    return method, pretrace(g, initial_state, method, reachable, **options)
+
+
+def parallel_pretraces(g, initial_state, methods, max_workers=None,
+                       **options):
+    """
+    Yield pairs (method, `pretrace(...)`) for all `methods` in the order they
+    are completed by a pool of processes.
+
+    The graph is sent to every worker once, when it starts. If `g` is a
+    `graphfile.GraphFile`, the workers map the same file instead. Methods with
+    the most prestates are scheduled first, so that the longest tasks don't
+    finish last. Instrumentation is not collected in the workers.
+    """
+    prestates, _ = cats.something(g)
+    order = sorted(methods, key=lambda m: len(prestates.get(m, ())),
+                   reverse=True)
+    if isinstance(g, graphfile.GraphFile):
+        shared = g.path
+    else:
+        shared = encode_graph(g)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers, initializer=_init_worker,
+            initargs=(shared, initial_state, options)) as pool:
+        futures = [pool.submit(_worker_pretrace, method) for method in order]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def analyse(model, **options) -> Analysis:
+    """
+    Run the temporal pipeline on `model`, a tuple
+    (variables, possible_states, initial_state, methods) like those in
+    `cases.py`. `options` are passed on to `regex.from_graph`.
+    """
+    _, possible_states, initial_state, methods = model
+    g = graph.from_program(possible_states, methods)
+    reachable = graph.reachable(g, [initial_state])
+    options = regex.shared_options(g, initial_state, options)
+    pretraces = {method: pretrace(g, initial_state, method, reachable,
+                                  **options)
+                 for method in methods}
+    naive = cats.naive_pretrace_from_graph(g, list(methods), initial_state)
+    return Analysis(model, g, naive, pretraces)
@@ -0,0 +1,417 @@
+"""
+Symbolic state transition graphs as binary decision diagrams (BDDs).
+
+The value of every state variable is encoded in bits, once for the prestate
+and once for the poststate, with the bits of both interleaved. Contracts are
+compiled into BDDs over these bits, with `Variable`s of postconditions mapped
+to poststate bits and `Old`s to prestate bits, and each method's transition
+relation is the conjunction of its pre- and postcondition. Reachability,
+prestates and poststates are computed with image and preimage operations on
+these relations, so no explicit graph is needed until `regex.from_graph` asks
+for one; it is then materialized over the reachable states only.
+"""
+
+import functools
+import itertools
+import math
+
+import boolexpr
+import instrument
+from boolexpr import Variable, Old, Rel, And, Or, Not, BoolTrue, BoolFalse
+
+FALSE = 0
+TRUE = 1
+
+
+class Manager:
+    """
+    Shared-node store of reduced ordered BDDs. Nodes are integers; `FALSE`
+    and `TRUE` are the terminals. Variables are identified by their level,
+    smaller levels are closer to the root.
+    """
+    def __init__(self, levels):
+        self.levels = levels
+        # terminals sit below all variables
+        self.level = [levels, levels]
+        self.low = [FALSE, TRUE]
+        self.high = [FALSE, TRUE]
+        self.unique = {}
+        self.cache = {}
+
+    def node(self, level, low, high):
+        """Return the node testing `level` with children `low` and `high`."""
+        if low == high:
+            return low
+        key = (level, low, high)
+        u = self.unique.get(key)
+        if u is None:
+            u = len(self.level)
+            self.level.append(level)
+            self.low.append(low)
+            self.high.append(high)
+            self.unique[key] = u
+        return u
+
+    def var(self, level, value=True):
+        """Return the BDD of the literal `level` (or its negation)."""
+        return (self.node(level, FALSE, TRUE) if value
+                else self.node(level, TRUE, FALSE))
+
+    def _cofactors(self, u, level):
+        if self.level[u] == level:
+            return self.low[u], self.high[u]
+        return u, u
+
+    def ite(self, f, g, h):
+        """Return the BDD of `if f then g else h`."""
+        if f == TRUE:
+            return g
+        if f == FALSE:
+            return h
+        if g == h:
+            return g
+        if g == TRUE and h == FALSE:
+            return f
+        key = ('ite', f, g, h)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        level = min(self.level[f], self.level[g], self.level[h])
+        f0, f1 = self._cofactors(f, level)
+        g0, g1 = self._cofactors(g, level)
+        h0, h1 = self._cofactors(h, level)
+        result = self.node(level, self.ite(f0, g0, h0), self.ite(f1, g1, h1))
+        self.cache[key] = result
+        return result
+
+    def conj(self, u, v):
+        return self.ite(u, v, FALSE)
+
+    def disj(self, u, v):
+        return self.ite(u, TRUE, v)
+
+    def neg(self, u):
+        return self.ite(u, FALSE, TRUE)
+
+    def and_exists(self, u, v, levels: frozenset):
+        """Return the BDD of `exists levels. u and v` (relational product)."""
+        if u == FALSE or v == FALSE:
+            return FALSE
+        if u == TRUE and v == TRUE:
+            return TRUE
+        if u > v:
+            u, v = v, u
+        key = ('and_exists', u, v, levels)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        level = min(self.level[u], self.level[v])
+        u0, u1 = self._cofactors(u, level)
+        v0, v1 = self._cofactors(v, level)
+        low = self.and_exists(u0, v0, levels)
+        if level in levels:
+            result = (TRUE if low == TRUE
+                      else self.disj(low, self.and_exists(u1, v1, levels)))
+        else:
+            result = self.node(level, low, self.and_exists(u1, v1, levels))
+        self.cache[key] = result
+        return result
+
+    def exists(self, u, levels: frozenset):
+        return self.and_exists(u, TRUE, levels)
+
+    def shift(self, u, offset):
+        """
+        Return `u` with every level l replaced by l + `offset`. The caller
+        guarantees that this keeps the order of the levels in `u`.
+        """
+        if u <= TRUE:
+            return u
+        key = ('shift', u, offset)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.node(self.level[u] + offset,
+                               self.shift(self.low[u], offset),
+                               self.shift(self.high[u], offset))
+            self.cache[key] = result
+        return result
+
+    def assignments(self, u, levels):
+        """
+        Yield the satisfying assignments of `u` as tuples of bits, one per
+        level of the sorted list `levels`, which must contain all levels `u`
+        depends on.
+        """
+        def walk(u, i, bits):
+            if u == FALSE:
+                return
+            if i == len(levels):
+                yield tuple(bits)
+                return
+            if self.level[u] == levels[i]:
+                branches = (self.low[u], self.high[u])
+            else:
+                branches = (u, u)
+            for bit, child in enumerate(branches):
+                bits.append(bit)
+                yield from walk(child, i + 1, bits)
+                bits.pop()
+        yield from walk(u, 0, [])
+
+
+class Symbolic:
+    """
+    The transition relations of `methods` over `possible_states`, in the
+    format of `graph.from_program`, as BDDs.
+
+    `domains` lists the values of each state variable. If they are given,
+    `possible_states` may be None for all combinations of these values, which
+    are then never enumerated. Otherwise they are taken from
+    `possible_states`.
+
+    The k-th bit of the value index of variable i is at level
+    2 * (first bit of i + k) for prestates and one level lower for poststates.
+    """
+    def __init__(self, possible_states, methods, domains=None):
+        self.possible_states = possible_states
+        if domains is None:
+            width = len(possible_states[0]) if possible_states else 0
+            domains = [{s[i] for s in possible_states} for i in range(width)]
+        self.domains = [sorted(domain) for domain in domains]
+        self.indices = [{v: n for n, v in enumerate(domain)}
+                        for domain in self.domains]
+        self.bits = [max(len(domain) - 1, 0).bit_length()
+                     for domain in self.domains]
+        self.offsets = list(itertools.accumulate(self.bits, initial=0))
+        self.manager = Manager(2 * self.offsets[-1])
+        self.pre_levels = [2 * b for b in range(self.offsets[-1])]
+        self.post_levels = [2 * b + 1 for b in range(self.offsets[-1])]
+        self._pre = frozenset(self.pre_levels)
+        self._post = frozenset(self.post_levels)
+
+        with instrument.stage('symbolic'):
+            self.valid = self._valid(possible_states)
+            valid_post = self.manager.shift(self.valid, 1)
+            self.relations = {}
+            for name, (pre, post) in methods.items():
+                relation = self.manager.conj(
+                        self.manager.conj(self.valid, valid_post),
+                        self.manager.conj(self.compile(pre, False),
+                                          self.compile(post, True)))
+                self.relations[name] = relation
+            self.any_relation = functools.reduce(
+                    self.manager.disj, self.relations.values(), FALSE)
+
+    def _valid(self, possible_states):
+        """
+        Return the BDD of `possible_states`: per variable if they are all
+        combinations of the domains, otherwise state by state.
+        """
+        m = self.manager
+        combinations = math.prod(map(len, self.domains))
+        if (possible_states is None
+                or len(possible_states) == combinations
+                and len(set(possible_states)) == combinations):
+            return functools.reduce(m.conj, (
+                    functools.reduce(m.disj, (self._value_bdd(i, v, False)
+                                              for v in domain), FALSE)
+                    for i, domain in enumerate(self.domains)), TRUE)
+        return functools.reduce(m.disj, map(self.encode, possible_states),
+                                FALSE)
+
+    def _value_bdd(self, var, value, post):
+        """Return the BDD of `var == value`, `value` from the domain of `var`."""
+        m = self.manager
+        index = self.indices[var][value]
+        u = TRUE
+        for k in reversed(range(self.bits[var])):
+            level = 2 * (self.offsets[var] + k) + post
+            u = m.conj(m.var(level, bool(index >> k & 1)), u)
+        return u
+
+    def encode(self, state, post=False):
+        """Return the BDD of the single state `state`."""
+        return functools.reduce(
+                self.manager.conj,
+                (self._value_bdd(i, v, post) for i, v in enumerate(state)),
+                TRUE)
+
+    def decode(self, bits):
+        """Return the state encoded by prestate `bits` in level order."""
+        state = []
+        for i, domain in enumerate(self.domains):
+            index = 0
+            for k in range(self.bits[i]):
+                index |= bits[self.offsets[i] + k] << k
+            state.append(domain[index])
+        return tuple(state)
+
+    def compile(self, expr: boolexpr.BoolExpr, post: bool):
+        """
+        Return the BDD of `expr`. With `post`, variables refer to the
+        poststate and \\old variables to the prestate, otherwise both refer to
+        the prestate.
+        """
+        if boolexpr.may_fail(expr):
+            # false where the evaluation fails
+            value, _ = self._compile_partial(expr, post)
+            return value
+        m = self.manager
+        match expr:
+            case BoolTrue():
+                return TRUE
+            case BoolFalse():
+                return FALSE
+            case And(left, right):
+                return m.conj(self.compile(left, post),
+                              self.compile(right, post))
+            case Or(left, right):
+                return m.disj(self.compile(left, post),
+                              self.compile(right, post))
+            case Not(e):
+                return m.neg(self.compile(e, post))
+            case Rel(_, _, _):
+                return self._compile_rel(expr, post)
+
+    def _compile_partial(self, expr, post):
+        """
+        Return the BDDs (value, fails) of `expr`, which may fail to evaluate:
+        where it evaluates to True, and where it divides by zero. Operands of
+        And and Or short-circuit as in `boolexpr.satisfies`.
+        """
+        if not boolexpr.may_fail(expr):
+            return self.compile(expr, post), FALSE
+        m = self.manager
+        match expr:
+            case And(left, right):
+                l_value, l_fails = self._compile_partial(left, post)
+                r_value, r_fails = self._compile_partial(right, post)
+                return (m.conj(l_value, r_value),
+                        m.disj(l_fails, m.conj(l_value, r_fails)))
+            case Or(left, right):
+                l_value, l_fails = self._compile_partial(left, post)
+                r_value, r_fails = self._compile_partial(right, post)
+                l_false = m.neg(m.disj(l_value, l_fails))
+                return (m.disj(l_value, m.conj(l_false, r_value)),
+                        m.disj(l_fails, m.conj(l_false, r_fails)))
+            case Not(e):
+                value, fails = self._compile_partial(e, post)
+                return m.neg(m.disj(value, fails)), fails
+            case Rel(_, _, _):
+                return (self._compile_rel(expr, post),
+                        self._compile_rel(expr, post, fails=True))
+
+    def _compile_rel(self, rel, post, fails=False):
+        """
+        Enumerate the values of the (few) variables in `rel` and return the
+        disjunction of the combinations satisfying it, or with `fails` of
+        those for which it divides by zero.
+        """
+        m = self.manager
+        atoms = []
+        def collect(value):
+            match value:
+                case Variable(i):
+                    atoms.append((i, post))
+                case Old(i):
+                    atoms.append((i, False))
+            return value
+        boolexpr.map_values(rel, collect)
+        atoms = list(dict.fromkeys(atoms))
+        result = FALSE
+        for values in itertools.product(
+                *(self.domains[i] for i, _ in atoms)):
+            state, prestate = {}, {}
+            for (i, is_post), v in zip(atoms, values):
+                (state if is_post or not post else prestate)[i] = v
+            if not post:
+                prestate = state
+            try:
+                outcome = rel.evaluate(state, prestate)
+            except ZeroDivisionError:
+                outcome = None
+            if outcome is not (None if fails else True):
+                continue
+            result = m.disj(result, functools.reduce(
+                    m.conj,
+                    (self._value_bdd(i, v, is_post)
+                     for (i, is_post), v in zip(atoms, values)),
+                    TRUE))
+        return result
+
+    def image(self, states, relation=None):
+        """Return the poststates of `relation` (all methods) from `states`."""
+        if relation is None:
+            relation = self.any_relation
+        m = self.manager
+        return m.shift(m.and_exists(states, relation, self._pre), -1)
+
+    def preimage(self, states, relation=None):
+        """Return the prestates of `relation` (all methods) into `states`."""
+        if relation is None:
+            relation = self.any_relation
+        m = self.manager
+        return m.and_exists(m.shift(states, 1), relation, self._post)
+
+    def reachable(self, initial_state):
+        """Return the BDD of the states reachable from `initial_state`."""
+        m = self.manager
+        result = frontier = self.encode(initial_state)
+        while frontier != FALSE:
+            new = self.image(frontier)
+            frontier = m.conj(new, m.neg(result))
+            result = m.disj(result, frontier)
+        return result
+
+    def states(self, u) -> list[tuple]:
+        """Return the states of the BDD `u` over prestate bits."""
+        return [self.decode(bits)
+                for bits in self.manager.assignments(u, self.pre_levels)]
+
+    def prestates(self, within=TRUE) -> dict:
+        """Return the prestates in `within` of every callable method."""
+        result = {}
+        for name, relation in self.relations.items():
+            pres = self.manager.conj(within, self.preimage(TRUE, relation))
+            if pres != FALSE:
+                result[name] = set(self.states(pres))
+        return result
+
+    def preceders(self, within=TRUE) -> dict:
+        """
+        Return the methods leading into each state from a prestate in
+        `within`.
+        """
+        result = {}
+        for name, relation in self.relations.items():
+            for state in self.states(self.image(within, relation)):
+                result.setdefault(state, set()).add(name)
+        return result
+
+    def to_graph(self, within=None) -> dict:
+        """
+        Return the explicit graph of `graph.from_program` with prestates
+        restricted to `within`, by default all possible states.
+        """
+        if within is None:
+            within = self.valid
+        m = self.manager
+        levels = sorted(self.pre_levels + self.post_levels)
+        result = {}
+        for name, relation in self.relations.items():
+            for bits in m.assignments(m.conj(within, relation), levels):
+                pre, post = self.decode(bits[0::2]), self.decode(bits[1::2])
+                result.setdefault(pre, {}).setdefault(name, []).append(post)
+        return result
+
+
+def from_program(possible_states, methods, initial_state=None, domains=None):
+    """
+    Like `graph.from_program`, computed symbolically. With `initial_state`,
+    only transitions from states reachable from it are materialized. See
+    `Symbolic` for `domains`.
+    """
+    symbolic = Symbolic(possible_states, methods, domains)
+    within = (None if initial_state is None
+              else symbolic.reachable(initial_state))
+    return symbolic.to_graph(within)
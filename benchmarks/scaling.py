@@ -0,0 +1,149 @@
+"""
+Scaling benchmark of the whole pipeline on synthetic machines (see
+`synthetic.py`).
+
+Run from the repository root, e.g.
+  python benchmarks/scaling.py --variables 1 2 3 4 --domain 3 --methods 8
+  python benchmarks/scaling.py --variables 1 2 3 --save base.json
+  python benchmarks/scaling.py --variables 1 2 3 --baseline base.json
+
+Every combination of the given parameter values is one point of the scaling
+curves. For each, the time of every stage, the peak memory and the total
+regex size before and after simplification are recorded and printed as one
+JSON line. Peak memory is measured in a second run with `tracemalloc`, which
+would distort the times of the first. With --sources, the models are parsed
+from generated `.rjava` files instead of being built directly, so the times
+include the parser. With --baseline, points are compared against a stored run
+and those slower by more than --tolerance are reported as regressions.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+import instrument
+import synthetic
+
+
+def _run(p, engine, sources_dir, memory):
+    """
+    Run the pipeline on the machine `p`; return the wall time and the
+    collected `instrument.stats()`.
+    """
+    instrument.reset()
+    instrument.enable(memory=memory)
+    start = time.perf_counter()
+    with instrument.stage('total'):
+        if sources_dir is None:
+            m = synthetic.model(p)
+        else:
+            import model
+            import parser
+            [path] = synthetic.write_sources(sources_dir, [p])
+            m = model.from_program(parser.parse(path))
+        analysis.analyse(m, engine=engine)
+    wall = time.perf_counter() - start
+    stats = instrument.stats()
+    instrument.disable()
+    return wall, stats
+
+
+def measure(p: synthetic.Parameters, engine, sources_dir=None, memory=True):
+    """
+    Run the pipeline on the machine `p`; return its measurements. With
+    `memory`, peak memory is measured in a second, untimed run.
+    """
+    wall, stats = _run(p, engine, sources_dir, memory=False)
+    peak = None
+    if memory:
+        _, memory_stats = _run(p, engine, sources_dir, memory=True)
+        peak = memory_stats['peak_memory_bytes'].get('total')
+    return {
+        'point': str(p),
+        'engine': engine,
+        'parameters': vars(p),
+        'seconds': round(wall, 6),
+        'stages': {name: timer['seconds']
+                   for name, timer in stats['timers'].items()},
+        'peak_memory_bytes': peak,
+        'counters': stats['counters'],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Yield (point, ratio) for points slower than the baseline."""
+    previous = {(r['point'], r['engine']): r for r in baseline}
+    for r in results:
+        before = previous.get((r['point'], r['engine']))
+        if before is None or before['seconds'] == 0:
+            continue
+        ratio = r['seconds'] / before['seconds']
+        if ratio > 1 + tolerance:
+            yield r['point'], r['engine'], round(ratio, 3)
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(
+            description=__doc__.split('\n\n')[0])
+    default = synthetic.Parameters()
+    argparser.add_argument('--variables', type=int, nargs='+',
+                           default=[default.variables])
+    argparser.add_argument('--domain', type=int, nargs='+',
+                           default=[default.domain])
+    argparser.add_argument('--methods', type=int, nargs='+',
+                           default=[default.methods])
+    argparser.add_argument('--density', type=float, nargs='+',
+                           default=[default.density])
+    argparser.add_argument('--old', choices=('yes', 'no', 'both'),
+                           default='both',
+                           help=r'whether postconditions use \old')
+    argparser.add_argument('--seed', type=int, nargs='+',
+                           default=[default.seed])
+    argparser.add_argument('--engine', nargs='+', default=['elimination'])
+    argparser.add_argument('--sources', action='store_true',
+                           help='go through generated .rjava sources')
+    argparser.add_argument('--memory', action=argparse.BooleanOptionalAction,
+                           default=True,
+                           help='measure peak memory in a second run')
+    argparser.add_argument('--save', help='store the results as JSON')
+    argparser.add_argument('--baseline', help='JSON file from --save')
+    argparser.add_argument('--tolerance', type=float, default=0.2,
+                           help='allowed relative slowdown')
+    args = argparser.parse_args(argv)
+
+    olds = {'yes': [True], 'no': [False], 'both': [False, True]}[args.old]
+    points = [synthetic.Parameters(*values) for values in itertools.product(
+            args.variables, args.domain, args.methods, args.density, olds,
+            args.seed)]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for p, engine in itertools.product(points, args.engine):
+            result = measure(p, engine, tmp if args.sources else None,
+                             args.memory)
+            print(json.dumps(result), flush=True)
+            results.append(result)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = list(compare(results, baseline, args.tolerance))
+        for point, engine, ratio in regressions:
+            print(f'regression: {point} ({engine}) {ratio}x baseline',
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Startup benchmark: import time of each entry path into the tool, measured in
+fresh interpreters.
+
+Run from the repository root:
+  python benchmarks/startup.py [--runs N] [--baseline FILE] [--save FILE]
+
+Prints the median wall-clock time of each entry path and the cumulative import
+time of its top-level module as reported by `python -X importtime`, as JSON.
+With --baseline, also prints the ratio to the stored medians.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entry path -> statement that enters it
+ENTRY_PATHS = {
+    'interpreter': 'pass',
+    'main': 'import main',
+    'models': 'import analysis, cases',
+    'parser': 'import parser',
+    'queries': 'import query; query.PROGRAM',
+    'cache': 'import cache',
+    'server': 'import server',
+}
+
+
+def _import_time_us(stderr):
+    """Sum the cumulative times of the top-level imports in -X importtime."""
+    total = 0
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\S.*)', line)
+        if match and not match.group(2).startswith(' '):
+            total += int(match.group(1))
+    return total
+
+
+def measure(statement, runs):
+    """Return (median seconds, median import microseconds) of `statement`."""
+    walls, imports = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', statement],
+                cwd=ROOT, capture_output=True, text=True)
+        walls.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return None
+        imports.append(_import_time_us(result.stderr))
+    return statistics.median(walls), statistics.median(imports)
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('--runs', type=int, default=10)
+    argparser.add_argument('--baseline', help='JSON file from --save')
+    argparser.add_argument('--save', help='store the results as JSON')
+    argparser.add_argument('paths', nargs='*', default=list(ENTRY_PATHS),
+                           help='entry paths to measure')
+    args = argparser.parse_args(argv)
+
+    results = {}
+    for name in args.paths:
+        measured = measure(ENTRY_PATHS[name], args.runs)
+        if measured is None:
+            results[name] = None  # e.g. tree-sitter not installed
+            continue
+        wall, imports = measured
+        results[name] = {'wall_ms': round(wall * 1e3, 2),
+                         'import_ms': round(imports / 1e3, 2)}
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        for name, result in results.items():
+            if result and baseline.get(name):
+                result['ratio'] = round(
+                        result['wall_ms'] / baseline[name]['wall_ms'], 3)
+
+    print(json.dumps(results, indent=2))
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
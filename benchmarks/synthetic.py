@@ -0,0 +1,121 @@
+"""
+Generator of synthetic state machines for benchmarking, in the model format
+of `cases.py` and as annotated `.rjava` sources for the parser path.
+
+A machine has `variables` ghost state variables with values 0..`domain`-1 and
+`methods` methods. Each method's precondition constrains each variable with
+probability `density` to one value, and its postcondition assigns each
+variable with probability `density`. With `old`, variables a method doesn't
+assign keep their value (`x == \\old(x)`); otherwise they are unconstrained.
+
+Each method body sets the variables its postcondition assigns. Like
+`model.from_program` for the source, the model's possible states are those
+that these set statements reach from the initial state, so both describe the
+same machine.
+"""
+
+import dataclasses
+import functools
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from boolexpr import And, BoolTrue, Equal, Old, Variable
+from model import states_reachable
+
+
+@dataclasses.dataclass(frozen=True)
+class Parameters:
+    variables: int = 2
+    domain: int = 3
+    methods: int = 4
+    density: float = 0.5
+    old: bool = False
+    seed: int = 0
+
+    def __str__(self):
+        return (f'v{self.variables}-d{self.domain}-m{self.methods}'
+                f'-p{self.density}-{"old" if self.old else "new"}'
+                f'-s{self.seed}')
+
+
+@dataclasses.dataclass
+class Contract:
+    requires: dict[int, int]    # variable -> required value
+    assigns: dict[int, int]     # variable -> assigned value
+
+
+def contracts(p: Parameters) -> dict[str, Contract]:
+    rng = random.Random(p.seed)
+    result = {}
+    for m in range(p.methods):
+        requires = {i: rng.randrange(p.domain) for i in range(p.variables)
+                    if rng.random() < p.density}
+        assigns = {i: rng.randrange(p.domain) for i in range(p.variables)
+                   if rng.random() < p.density}
+        if not assigns:
+            # every method changes something, or the machine is trivial
+            i = rng.randrange(p.variables)
+            assigns[i] = rng.randrange(p.domain)
+        result[f'm{m}'] = Contract(requires, assigns)
+    return result
+
+
+def _conjunction(clauses):
+    return functools.reduce(And, clauses) if clauses else BoolTrue()
+
+
+def model(p: Parameters):
+    """Return (variables, possible_states, initial_state, methods)."""
+    variables = tuple(f's{i}' for i in range(p.variables))
+    initial_state = (0,) * p.variables
+    cs = contracts(p)
+    possible_states = states_reachable(
+            ([(i, v, False) for i, v in c.assigns.items()]
+             for c in cs.values()),
+            initial_state)
+    methods = {}
+    for name, c in cs.items():
+        pre = _conjunction([Equal(Variable(i), v)
+                            for i, v in c.requires.items()])
+        posts = [Equal(Variable(i), v) for i, v in c.assigns.items()]
+        if p.old:
+            posts += [Equal(Variable(i), Old(i)) for i in range(p.variables)
+                      if i not in c.assigns]
+        methods[name] = (pre, _conjunction(posts))
+    return variables, possible_states, initial_state, methods
+
+
+def rjava(p: Parameters) -> str:
+    """Return an annotated source with the same machine as `model(p)`."""
+    lines = [f'//@ ghost final int V{v} = {v};' for v in range(p.domain)]
+    lines += [f'//@ ghost int s{i} = V0;' for i in range(p.variables)]
+    for name, c in contracts(p).items():
+        lines.append('')
+        requires = ' && '.join(f's{i} == V{v}' for i, v in c.requires.items())
+        if requires:
+            lines.append(f'//@ requires {requires};')
+        ensures = [f's{i} == V{v}' for i, v in c.assigns.items()]
+        if p.old:
+            ensures += [f's{i} == \\old(s{i})' for i in range(p.variables)
+                        if i not in c.assigns]
+        lines.append(f'//@ ensures {" && ".join(ensures)};')
+        lines.append(f'void {name}() {{')
+        lines += [f'  //@set s{i} = V{v};' for i, v in c.assigns.items()]
+        lines.append('  return;')
+        lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_sources(directory, parameters):
+    """Write `rjava(p)` for each of `parameters` into `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for p in parameters:
+        path = os.path.join(directory, f'{p}.rjava')
+        with open(path, 'w') as file:
+            file.write(rjava(p))
+        paths.append(path)
+    return paths
@@ -2,9 +2,9 @@
 Classes for modeling boolean expressions in JML clauses. Being a subset of JML
 boolean expressions, Java boolean expressions may be modeled too.
 
-TODO:
-    - binary comparisons should be able to contain full expressions too. Add
-      those cases.
+Comparisons compare integer terms: variables, literals and arithmetic on them.
+Arithmetic follows Java's int semantics for division and remainder. An
+expression whose evaluation divides by zero is false.
 """
 
 import dataclasses
@@ -15,6 +15,13 @@ dataclass = functools.partial(
         dataclasses.dataclass,
         slots=True, frozen=True)
 
+# Entries kept by each memoized function of this module. Bounded, so that a
+# long-running process like `server` doesn't accumulate the expressions of
+# every analysis it has ever run.
+CACHE_SIZE = 2**14
+
+_memoized = functools.lru_cache(maxsize=CACHE_SIZE)
+
 @dataclass
 class Value:
     def resolve(self, state, prestate):
@@ -26,6 +33,20 @@ class Value:
                 result = state[i]
             case Old(i):
                 result = prestate[i]
+            case Arith(kind, left, right):
+                result = _OPERATIONS[kind](left.resolve(state, prestate),
+                                           right.resolve(state, prestate))
+        return result
+
+    def contains_old(self):
+        r"""Return True if the term contains any \old() variables."""
+        match self:
+            case Old(_):
+                result = True
+            case Arith(_, left, right):
+                result = left.contains_old() or right.contains_old()
+            case _:
+                result = False
         return result
 
 @dataclass
@@ -40,6 +61,69 @@ class Old(Value):
 class Literal(Value):
     value: int
 
+class ArithType(Enum):
+    ADD = auto()
+    SUB = auto()
+    MUL = auto()
+    DIV = auto()
+    MOD = auto()
+
+@dataclass
+class Arith(Value):
+    kind: ArithType
+    left: Value
+    right: Value
+
+
+def _div(a, b):
+    """Integer division rounding towards zero, like Java's `/`."""
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+def _mod(a, b):
+    """Remainder with the sign of the dividend, like Java's `%`."""
+    return a - b * _div(a, b)
+
+_OPERATIONS = {
+    ArithType.ADD: lambda a, b: a + b,
+    ArithType.SUB: lambda a, b: a - b,
+    ArithType.MUL: lambda a, b: a * b,
+    ArithType.DIV: _div,
+    ArithType.MOD: _mod,
+}
+
+def _to_literal(node):
+    return Literal(node) if isinstance(node, int) else node
+
+def arith(kind, left, right):
+    """
+    Constructor for Arith.
+    Folds operations on two literals, except division by zero, which is left
+    to fail at evaluation.
+    """
+    left, right = map(_to_literal, (left, right))
+    match left, right:
+        case Literal(_), Literal(0) if kind in (ArithType.DIV, ArithType.MOD):
+            pass
+        case Literal(a), Literal(b):
+            return Literal(_OPERATIONS[kind](a, b))
+    return Arith(kind, left, right)
+
+def Add(left, right):
+    return arith(ArithType.ADD, left, right)
+
+def Sub(left, right):
+    return arith(ArithType.SUB, left, right)
+
+def Mul(left, right):
+    return arith(ArithType.MUL, left, right)
+
+def Div(left, right):
+    return arith(ArithType.DIV, left, right)
+
+def Mod(left, right):
+    return arith(ArithType.MOD, left, right)
+
 
 @dataclass
 class BoolExpr:
@@ -48,7 +132,7 @@ class BoolExpr:
         r"""Return True if the expression contains any \old() variables."""
         match self:
             case Rel(_, left, right):
-                result = Old in (type(left), type(right))
+                result = left.contains_old() or right.contains_old()
             case And(left, right) | Or(left, right):
                 result = left.contains_old() or right.contains_old()
             case Not(e):
@@ -128,9 +212,7 @@ class Rel(BoolExpr):
         return result
 
 def _rel(kind, left, right):
-    def to_literal(node):
-        return Literal(node) if isinstance(node, int) else node
-    left, right = map(to_literal, (left, right))
+    left, right = map(_to_literal, (left, right))
     return Rel(kind, left, right)
 
 def Equal(left, right):
@@ -152,13 +234,43 @@ def GreaterEqual(left, right):
     return _rel(RelType.GREATER_EQUAL, left, right)
 
 
+def chain(kind, operands, construct=None) -> BoolExpr:
+    """
+    Return the And or Or (`kind`) of `operands` as a balanced tree, built by
+    `construct(left, right)`, by default `kind` itself. It is evaluated in
+    the same order as a linear chain and short-circuits the same way, but
+    its depth only grows logarithmically with the number of operands, so that
+    long chains don't exceed the recursion limit of the functions below.
+    Without operands, return the unit of `kind`.
+    """
+    if construct is None:
+        construct = kind
+    operands = list(operands)
+    if not operands:
+        return BoolTrue() if kind is And else BoolFalse()
+    while len(operands) > 1:
+        pairs = [construct(left, right)
+                 for left, right in zip(operands[0::2], operands[1::2])]
+        operands = pairs + operands[2 * len(pairs):]
+    return operands[0]
+
+
 def satisfies(state: tuple[int], expr: BoolExpr, prestate=None) -> bool:
     """
     Return True if the variable mapping represented by `state` satisfies
-    the boolean expression `expr`.
+    the boolean expression `expr`. Operands of And and Or are evaluated from
+    left to right and only as far as needed, like Java's && and ||. If the
+    evaluation divides by zero, `expr` is not satisfied.
 
     `state` has to map all variables; KeyError may be raised otherwise.
     """
+    try:
+        return _satisfies(state, expr, prestate)
+    except ZeroDivisionError:
+        return False
+
+
+def _satisfies(state, expr, prestate):
     match expr:
         case BoolTrue():
             result = True
@@ -167,15 +279,17 @@ def satisfies(state: tuple[int], expr: BoolExpr, prestate=None) -> bool:
         case Rel(_, _, _):
             result = expr.evaluate(state, prestate)
         case And(left, right):
-            result = satisfies(state, left) and satisfies(state, right)
+            result = (_satisfies(state, left, prestate)
+                      and _satisfies(state, right, prestate))
         case Or(left, right):
-            result = satisfies(state, left) or satisfies(state, right)
+            result = (_satisfies(state, left, prestate)
+                      or _satisfies(state, right, prestate))
         case Not(a):
-            result = not satisfies(state, a)
+            result = not _satisfies(state, a, prestate)
     return result
 
 
-@functools.cache
+@_memoized
 def downprop_negations(a: BoolExpr) -> BoolExpr:
     """
     Eliminate `Not` by propagating them downwards and return the result. The
@@ -190,10 +304,8 @@ def downprop_negations(a: BoolExpr) -> BoolExpr:
             result = BoolFalse()
         case Not(BoolFalse()):
             result = BoolTrue()
-        case Not(Equal(name, val)):
-            result = NotEqual(name, val)
-        case Not(NotEqual(name, val)):
-            result = Equal(name, val)
+        case Not(Rel() as rel):
+            result = rel.negation()
         case Not(And(left, right)):
             left, right = map(lambda x: downprop_negations(Not(x)), (left, right))
             result = Or(left, right)
@@ -210,6 +322,81 @@ def downprop_negations(a: BoolExpr) -> BoolExpr:
             result = Or(left, right)
     return result
 
+# Compiled evaluation #
+# Contracts are evaluated for every state or pair of states. Compiling them into
+# a single Python expression avoids walking the tree on every evaluation.
+
+_OPERATORS = {
+    ArithType.ADD: '+',
+    ArithType.SUB: '-',
+    ArithType.MUL: '*',
+    RelType.EQUAL: '==',
+    RelType.NOT_EQUAL: '!=',
+    RelType.LESS_THAN: '<',
+    RelType.LESS_EQUAL: '<=',
+    RelType.GREATER_THAN: '>',
+    RelType.GREATER_EQUAL: '>=',
+}
+
+def _source(expr) -> str:
+    """Return Python source code evaluating `expr` on `state` and `prestate`."""
+    match expr:
+        case Literal(x):
+            return repr(x)
+        case Variable(i):
+            return f'state[{i!r}]'
+        case Old(i):
+            return f'prestate[{i!r}]'
+        case Arith(ArithType.DIV, left, right):
+            return f'_div({_source(left)}, {_source(right)})'
+        case Arith(ArithType.MOD, left, right):
+            return f'_mod({_source(left)}, {_source(right)})'
+        case Arith(kind, left, right) | Rel(kind, left, right):
+            return f'({_source(left)} {_OPERATORS[kind]} {_source(right)})'
+        case And(_, _) | Or(_, _):
+            # flattened, so that long chains don't nest too deeply to compile
+            operands = []
+            todo = [expr]
+            while todo:
+                e = todo.pop()
+                if type(e) is type(expr):
+                    todo += (e.right, e.left)
+                else:
+                    operands.append(_source(e))
+            joiner = ' and ' if isinstance(expr, And) else ' or '
+            return f'({joiner.join(operands)})'
+        case Not(e):
+            return f'(not {_source(e)})'
+        case BoolTrue():
+            return 'True'
+        case BoolFalse():
+            return 'False'
+
+
+@_memoized
+def compile_expr(expr: BoolExpr):
+    """
+    Return a function `(state, prestate=None) -> bool` equivalent to
+    `satisfies(state, expr, prestate)`.
+    """
+    code = f'lambda state, prestate=None: {_source(expr)}'
+    func = eval(code, {'_div': _div, '_mod': _mod})
+    if not may_fail(expr):
+        return func
+
+    def guarded(state, prestate=None):
+        try:
+            return func(state, prestate)
+        except ZeroDivisionError:
+            return False
+    return guarded
+
+
+def compiled_satisfies(state, expr: BoolExpr, prestate=None) -> bool:
+    """Like `satisfies`, using `compile_expr`."""
+    return compile_expr(expr)(state, prestate)
+
+
 def implies(a, b):
     return not(a) or b
 
@@ -221,11 +408,12 @@ def expr_satisfies(one: BoolExpr, other: BoolExpr) -> bool:
             result = True
         case _, BoolFalse():
             result = False
-        case Equal(a, x), Equal(b, y):
+        case Rel(RelType.EQUAL, a, x), Rel(RelType.EQUAL, b, y):
             result = implies(a == b, x == y)
-        case (Equal(a, x), NotEqual(b, y)) | (NotEqual(a, x), Equal(b, y)):
+        case ((Rel(RelType.EQUAL, a, x), Rel(RelType.NOT_EQUAL, b, y))
+              | (Rel(RelType.NOT_EQUAL, a, x), Rel(RelType.EQUAL, b, y))):
             result = implies(a == b, x != y)
-        case NotEqual(a, x), NotEqual(b, y):
+        case Rel(RelType.NOT_EQUAL, _, _), Rel(RelType.NOT_EQUAL, _, _):
             result = True
         case And(a, b), right:
             result = (expr_satisfies(a, right)
@@ -239,6 +427,8 @@ def expr_satisfies(one: BoolExpr, other: BoolExpr) -> bool:
         case left, Or(a, b):
             result = (expr_satisfies(left, a)
                     or expr_satisfies(left, b))
+        case _:
+            result = False
     return result
 
 
@@ -251,9 +441,161 @@ def rename_old(expr, remap):
     match expr:
         case Old(i):
             return Variable(remap[i])
-        case Literal(_) | Variable(_) | RelType():
+        case Literal(_) | Variable(_) | RelType() | ArithType():
             return expr
     constr = type(expr)
     args = (getattr(expr, slot) for slot in expr.__slots__)
     args = (rename_old(arg, remap) for arg in args)
     return constr(*args)
+
+
+def map_values(expr, func):
+    """
+    Return `expr` with every `Variable`, `Old` and `Literal` `v` in it replaced
+    by `func(v)`. Arithmetic on literals is folded.
+    """
+    match expr:
+        case Arith(kind, left, right):
+            return arith(kind, map_values(left, func), map_values(right, func))
+        case Value():
+            return func(expr)
+        case RelType():
+            return expr
+    constr = type(expr)
+    args = (getattr(expr, slot) for slot in expr.__slots__)
+    args = (map_values(arg, func) for arg in args)
+    return constr(*args)
+
+
+def variables(expr) -> set:
+    r"""Return the ids of all variables in `expr`, including \old ones."""
+    result = set()
+    def collect(value):
+        if not isinstance(value, Literal):
+            result.add(value.var_id)
+        return value
+    map_values(expr, collect)
+    return result
+
+
+def conjuncts(expr: BoolExpr) -> list[BoolExpr]:
+    """Split `expr` into the operands of its top-level conjunctions."""
+    return _operands(expr, And)
+
+
+# Canonical form #
+# Equivalent clauses are often written differently, e.g. `a == 1 && b < 2` and
+# `2 > b && 1 == a`. Canonical forms make them equal, so that they can share
+# cached results. Expressions that may fail to evaluate (division by zero) keep
+# the order of their operands, since Java's && and || short-circuit, and
+# failing makes the whole expression false (see `satisfies`).
+
+_FLIPPED = {
+    RelType.GREATER_THAN: RelType.LESS_THAN,
+    RelType.GREATER_EQUAL: RelType.LESS_EQUAL,
+}
+
+_COMMUTATIVE = frozenset((RelType.EQUAL, RelType.NOT_EQUAL,
+                          ArithType.ADD, ArithType.MUL))
+
+@_memoized
+def _intern(expr):
+    """Return the first of the recently seen expressions equal to `expr`."""
+    return expr
+
+
+@_memoized
+def may_fail(expr) -> bool:
+    """Return True if evaluating `expr` may raise, i.e. it divides."""
+    match expr:
+        case Arith(ArithType.DIV | ArithType.MOD, _, _):
+            return True
+        case Arith(_, left, right) | Rel(_, left, right) \
+                | And(left, right) | Or(left, right):
+            return may_fail(left) or may_fail(right)
+        case Not(e):
+            return may_fail(e)
+    return False
+
+
+def _operands(expr, kind):
+    """Return the operands of a chain of `kind` (And or Or) in order."""
+    result = []
+    todo = [expr]
+    while todo:
+        e = todo.pop()
+        if isinstance(e, kind):
+            todo += (e.right, e.left)
+        else:
+            result.append(e)
+    return result
+
+
+def _canonical_value(value):
+    match value:
+        case Arith(kind, left, right):
+            left, right = map(_canonical_value, (left, right))
+            if kind in _COMMUTATIVE and repr(right) < repr(left):
+                left, right = right, left
+            return arith(kind, left, right)
+    return value
+
+
+def _canonical_rel(rel):
+    kind = _FLIPPED.get(rel.kind, rel.kind)
+    left, right = map(_canonical_value, (rel.left, rel.right))
+    if kind != rel.kind or (kind in _COMMUTATIVE and repr(right) < repr(left)):
+        left, right = right, left
+    if (isinstance(left, Literal) and isinstance(right, Literal)
+            and not may_fail(rel)):
+        return BoolTrue() if Rel(kind, left, right).evaluate(()) else BoolFalse()
+    return Rel(kind, left, right)
+
+
+def _canonical_chain(expr, kind):
+    """Flatten, simplify, deduplicate and sort the operands of And/Or."""
+    unit, zero = (BoolTrue(), BoolFalse()) if kind is And else \
+            (BoolFalse(), BoolTrue())
+    operands = {}
+    for operand in _operands(expr, kind):
+        operand = canonical(operand)
+        if operand == zero:
+            if not any(map(may_fail, operands)):
+                return zero
+            # the preceding operands may fail, which makes the chain false
+            operands.setdefault(zero)
+            break
+        if operand == unit:
+            continue
+        for nested in _operands(operand, kind):
+            operands.setdefault(nested)
+    operands = list(operands)
+    if not any(map(may_fail, operands)):
+        operands.sort(key=repr)
+    return chain(kind, operands)
+
+
+@_memoized
+def canonical(expr: BoolExpr) -> BoolExpr:
+    """
+    Return the canonical form of `expr`: negations pushed down to the
+    comparisons, > and >= turned into < and <=, operands of commutative
+    comparisons and arithmetic ordered, comparisons of literals evaluated, and
+    chains of And/Or flattened, deduplicated and sorted. Equivalent clauses
+    that only differ in these respects have the same canonical form, which is
+    interned: as long as it is cached, it is the same object.
+    """
+    match expr:
+        case Rel():
+            result = _canonical_rel(expr)
+        case And(_, _):
+            result = _canonical_chain(expr, And)
+        case Or(_, _):
+            result = _canonical_chain(expr, Or)
+        case Not(e):
+            e = downprop_negations(Not(e))
+            result = (Not(canonical(e.expr)) if isinstance(e, Not)
+                      else canonical(e))
+        case _:
+            result = expr
+    return _intern(result)
@@ -0,0 +1,187 @@
+"""
+Persistent on-disk cache of analysis results, keyed by a hash of the source
+code and the analysis options.
+
+Entries are zlib-compressed pickles. They are written to a temporary file and
+renamed into place, so concurrent readers never see partial entries and
+concurrent writers of the same entry don't interfere. The least recently used
+entries are evicted when the cache grows beyond its size limit. The cache
+directory is only scanned when a running estimate of its size exceeds the
+limit, and eviction frees some headroom, so that puts don't rescan it.
+"""
+
+import dataclasses
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+import analysis
+import model
+import sources
+
+# Bump when the format of cached artifacts changes.
+VERSION = 12
+
+
+@dataclasses.dataclass
+class Entry:
+    program: sources.Program
+    # None if the program has no model, see `error`
+    analysis: analysis.Analysis | None
+    # why `model.from_program` rejected the program, e.g. constructors that
+    # leave the state variables in different states
+    error: str | None = None
+
+
+class Cache:
+    # fraction of `max_bytes` that eviction shrinks the cache to
+    LOW_WATER = 0.9
+
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # estimated total size of the entries, None until first needed
+        self._total = None
+
+    @staticmethod
+    def key(code: bytes, options) -> str:
+        """Return the key of the analysis of `code` with `options`."""
+        h = hashlib.sha256()
+        h.update(f'{VERSION}:{sorted(options.items())!r}:'.encode())
+        h.update(code)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key) -> Entry | None:
+        """Return the entry for `key`, or None if there is none."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        try:
+            return pickle.loads(zlib.decompress(data))
+        except (zlib.error, pickle.UnpicklingError, EOFError):
+            return None
+
+    def put(self, key, entry: Entry):
+        """Store `entry` under `key`, then evict entries if necessary."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(pickle.dumps(entry, protocol=5))
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._entries())
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        # entries written by other processes are only noticed by `evict`
+        self._total += len(data)
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime_ns, stat.st_size, path
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits its limit
+        with some headroom.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        limit = (self.max_bytes if total <= self.max_bytes
+                 else int(self.max_bytes * self.LOW_WATER))
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
+
+
+def _analyse(program, **options) -> Entry:
+    try:
+        m = model.from_program(program)
+    except ValueError as e:
+        return Entry(program, None, str(e))
+    return Entry(program, analysis.analyse(m, **options))
+
+
+def analyse_source(code: bytes, cache: Cache | None = None,
+                   **options) -> Entry:
+    """
+    Return the extracted program and analysis of the source `code`, from
+    `cache` if possible. `options` are passed on to `regex.from_graph`. If the
+    program has no model, the entry has its error instead of an analysis.
+    """
+    if cache is not None:
+        key = Cache.key(code, options)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    import parser # only needed on cache misses
+    entry = _analyse(parser.program_from_tree(parser.parse_bytes(code)),
+                     **options)
+    if cache is not None:
+        cache.put(key, entry)
+    return entry
+
+
+def analyse_file(path, cache: Cache | None = None, **options) -> Entry:
+    """Like `analyse_source`, for the source file at `path`."""
+    with open(path, 'rb') as file:
+        return analyse_source(file.read(), cache, **options)
+
+
+def analyse_files(paths, cache: Cache, max_workers=None, **options):
+    """
+    Like `analyse_file` for all source files in `paths` (see
+    `sources.source_files`). Files missing from `cache` are parsed across a
+    pool of processes with `parser.extract_many`.
+
+    Yield pairs (path, Entry) in the order of the files.
+    """
+    files = list(sources.source_files(paths))
+    # the code of each miss is kept, so that what is parsed is what was hashed
+    keys, entries, misses = {}, {}, []
+    for path in files:
+        with open(path, 'rb') as file:
+            code = file.read()
+        keys[path] = Cache.key(code, options)
+        entries[path] = cache.get(keys[path])
+        if entries[path] is None:
+            misses.append(code)
+    programs = iter(())
+    if misses:
+        import parser # only needed on cache misses
+        programs = parser.extract_many(misses, max_workers)
+    for path in files:
+        entry = entries[path]
+        if entry is None:
+            entry = _analyse(next(programs), **options)
+            cache.put(keys[path], entry)
+        yield path, entry
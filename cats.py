@@ -119,7 +119,7 @@ def naive_pretrace_from_graph(graph, methods, initial_state):
     that may run right before the method.
 
     Union with ⋅⋅excl[all] if the method's prestates include an initial
-    state.
+    state. Methods without prestates are left out.
     """
     prestates, preceders = something(graph)
     result = {}
@@ -127,6 +127,8 @@ def naive_pretrace_from_graph(graph, methods, initial_state):
     exclude_all_methods = AbstractTrace(methods)
 
     for method in methods:
+        if method not in prestates:
+            continue
         m_pres = prestates[method]
         pops = set()
         for pre in m_pres:
@@ -0,0 +1,410 @@
+"""
+Differential testing of alternative engines against the reference
+implementations of the pipeline's core steps:
+  'satisfies'  boolexpr.satisfies(state, expr, prestate=None)
+  'graph'      graph.from_program_reference(possible_states, methods)
+  'regex'      regex.from_graph(graph, initial_state, method)
+  'affected'   graph.affected_methods(old_graph, new_graph, initial_state,
+                                     changed)
+
+Alternative engines are registered with `register` under one of these kinds
+and must have the same signature as the reference. They are run side by side
+with the reference on random models. Results of 'satisfies' and 'graph' must
+be equal, those of 'regex' must describe the same language, and those of
+'affected' must include the reference's: the methods whose pretraces really
+differ after the contract of one method is changed. Failing models are shrunk
+to a minimal counterexample. The models of `REGRESSIONS` are checked first.
+
+Run all registered engines with
+  python differential.py [--cases N] [--seed S]
+Keep the random models small: regexes from state elimination grow
+exponentially with the number of states.
+"""
+
+import argparse
+import dataclasses
+import functools
+import itertools
+import random
+
+import bdd
+import boolexpr
+import graph
+import regex
+from boolexpr import (And, Or, Not, BoolTrue, BoolFalse, Rel, RelType,
+                      Variable, Old, Literal, ArithType)
+
+
+def _pretrace(g, initial_state, method):
+    """Return the pretrace of `method`, None if it can never be called."""
+    if not any(method in g.get(state, {})
+               for state in graph.reachable(g, [initial_state])):
+        return None
+    return regex.from_graph(g, initial_state, method)
+
+
+def changed_pretraces(old_graph, new_graph, initial_state, changed):
+    """
+    Return the methods whose pretraces differ between `old_graph` and
+    `new_graph`, by computing all of them in both.
+    """
+    methods = set(changed)
+    for g in (old_graph, new_graph):
+        for transitions in g.values():
+            methods.update(transitions)
+    result = set()
+    for method in methods:
+        old = _pretrace(old_graph, initial_state, method)
+        new = _pretrace(new_graph, initial_state, method)
+        if (old is None or new is None) and old is not new:
+            result.add(method)
+        elif old is not None and not regex.equivalent(old, new):
+            result.add(method)
+    return result
+
+
+REFERENCE = {
+    'satisfies': boolexpr.satisfies,
+    'graph': graph.from_program_reference,
+    'regex': regex.from_graph,
+    'affected': changed_pretraces,
+}
+
+ENGINES = {kind: {} for kind in REFERENCE}
+
+
+def register(kind, name, func):
+    """Register `func` as an alternative engine for `kind`."""
+    ENGINES[kind][name] = func
+
+
+register('satisfies', 'compiled', boolexpr.compiled_satisfies)
+register('satisfies', 'canonical',
+         lambda state, expr, prestate=None:
+             boolexpr.satisfies(state, boolexpr.canonical(expr), prestate))
+register('graph', 'compiled', graph.from_program)
+register('graph', 'clauses',
+         functools.partial(graph.from_program, satisfies=boolexpr.satisfies))
+register('graph', 'bdd', bdd.from_program)
+register('regex', 'equations',
+         functools.partial(regex.from_graph, engine='equations'))
+register('regex', 'scc', functools.partial(regex.from_graph, engine='scc'))
+register('affected', 'incremental', graph.affected_methods)
+
+
+@dataclasses.dataclass
+class Case:
+    possible_states: list[tuple]
+    initial_state: tuple
+    methods: dict[str, tuple[boolexpr.BoolExpr, boolexpr.BoolExpr]]
+
+
+# Random models #
+
+def _random_value(rng, variables, domain, old, depth=1):
+    if depth > 0 and rng.random() < 0.2:
+        kind = rng.choice(list(ArithType))
+        # divisors may be zero, which makes the expression false
+        left = _random_value(rng, variables, domain, old, depth - 1)
+        right = _random_value(rng, variables, domain, old, depth - 1)
+        return boolexpr.arith(kind, left, right)
+    kinds = [Variable, Literal] + ([Old] if old else [])
+    kind = rng.choice(kinds)
+    if kind is Literal:
+        return Literal(rng.randrange(domain))
+    return kind(rng.randrange(variables))
+
+
+def random_expr(rng, variables, domain, depth, old=False):
+    """Return a random boolean expression over `variables` variables."""
+    if depth == 0 or rng.random() < 0.3:
+        if rng.random() < 0.1:
+            return rng.choice((BoolTrue(), BoolFalse()))
+        return Rel(rng.choice(list(RelType)),
+                   _random_value(rng, variables, domain, old),
+                   _random_value(rng, variables, domain, old))
+    match rng.randrange(3):
+        case 0:
+            return And(random_expr(rng, variables, domain, depth - 1, old),
+                       random_expr(rng, variables, domain, depth - 1, old))
+        case 1:
+            return Or(random_expr(rng, variables, domain, depth - 1, old),
+                      random_expr(rng, variables, domain, depth - 1, old))
+        case 2:
+            return Not(random_expr(rng, variables, domain, depth - 1, old))
+
+
+def random_case(rng, variables=2, domain=2, methods=3, depth=2) -> Case:
+    all_states = list(itertools.product(range(domain), repeat=variables))
+    possible_states = [s for s in all_states if rng.random() < 0.8]
+    initial_state = (0,) * variables
+    if initial_state not in possible_states:
+        possible_states.insert(0, initial_state)
+    contracts = {
+        f'm{i}': (random_expr(rng, variables, domain, depth),
+                  random_expr(rng, variables, domain, depth, old=True))
+        for i in range(methods)}
+    return Case(possible_states, initial_state, contracts)
+
+
+# Comparison #
+
+def _outcome(func, *args, **kwargs):
+    """Return ('ok', result) or ('error', exception type) of a call."""
+    try:
+        return 'ok', func(*args, **kwargs)
+    except Exception as e:
+        return 'error', type(e)
+
+
+def _edges(g):
+    return {(pre, method, post)
+            for pre, transitions in g.items()
+            for method, posts in transitions.items()
+            for post in posts}
+
+
+def check_satisfies(engine, case: Case):
+    """Return a description of the first disagreement, or None."""
+    reference = REFERENCE['satisfies']
+    for name, (pre, post) in case.methods.items():
+        for state in case.possible_states:
+            if (_outcome(reference, state, pre)
+                    != _outcome(engine, state, pre)):
+                return f'{name} precondition in {state}'
+            for prestate in case.possible_states:
+                if (_outcome(reference, state, post, prestate)
+                        != _outcome(engine, state, post, prestate)):
+                    return f'{name} postcondition in {prestate} -> {state}'
+    return None
+
+
+def check_graph(engine, case: Case):
+    expected = REFERENCE['graph'](case.possible_states, case.methods)
+    actual = engine(case.possible_states, case.methods)
+    missing, extra = _edges(expected) - _edges(actual), \
+            _edges(actual) - _edges(expected)
+    if missing or extra:
+        return f'missing {sorted(missing)}, extra {sorted(extra)}'
+    return None
+
+
+def check_regex(engine, case: Case):
+    g = REFERENCE['graph'](case.possible_states, case.methods)
+    for method in case.methods:
+        expected = _outcome(REFERENCE['regex'], g, case.initial_state, method)
+        actual = _outcome(engine, g, case.initial_state, method)
+        match expected, actual:
+            case ('ok', l), ('ok', r):
+                if not regex.equivalent(l, r):
+                    return f'{method}: {l} is not equivalent to {r}'
+            case _ if expected != actual:
+                return f'{method}: {expected} but {actual}'
+    return None
+
+
+def _changed_contracts(pre, post):
+    """Yield edits of the contract (`pre`, `post`) of a method."""
+    yield BoolFalse(), post
+    yield Not(pre), post
+    yield pre, Not(post)
+
+
+def check_affected(engine, case: Case):
+    old = REFERENCE['graph'](case.possible_states, case.methods)
+    for name, (pre, post) in case.methods.items():
+        for contract in _changed_contracts(pre, post):
+            methods = case.methods | {name: contract}
+            new = REFERENCE['graph'](case.possible_states, methods)
+            expected = REFERENCE['affected'](old, new, case.initial_state,
+                                             {name})
+            actual = _outcome(engine, old, new, case.initial_state, {name})
+            match actual:
+                case 'error', error:
+                    return f'{name} changed to {contract}: {error.__name__}'
+                case 'ok', affected if not expected <= affected:
+                    return (f'{name} changed to {contract}: missing '
+                            f'{sorted(expected - affected)}')
+    return None
+
+
+CHECKS = {
+    'satisfies': check_satisfies,
+    'graph': check_graph,
+    'regex': check_regex,
+    'affected': check_affected,
+}
+
+# Models on which engines once failed, checked before the random ones
+REGRESSIONS = {kind: [] for kind in REFERENCE}
+# unguarded division by zero: `requires 10 / count > 1` with count == 0, also
+# negated and in front of an operand that would decide the result
+_DIVIDES = Rel(RelType.GREATER_THAN,
+               boolexpr.arith(ArithType.DIV, Literal(10), Variable(0)),
+               Literal(1))
+_DIVISION_BY_ZERO = Case(
+        [(0,), (1,), (2,)], (0,),
+        {'m': (_DIVIDES, Rel(RelType.EQUAL, Variable(0), Literal(1))),
+         'n': (Not(_DIVIDES), Rel(RelType.EQUAL, Variable(0), Old(0))),
+         'k': (Or(_DIVIDES, BoolTrue()),
+               And(Rel(RelType.NOT_EQUAL, Old(0), Literal(0)),
+                   Rel(RelType.EQUAL,
+                       boolexpr.arith(ArithType.MOD, Literal(7), Old(0)),
+                       Variable(0))))})
+REGRESSIONS['satisfies'].append(_DIVISION_BY_ZERO)
+REGRESSIONS['graph'].append(_DIVISION_BY_ZERO)
+# `requires` and `ensures` with chains of 2000 && and || as built by the
+# parser, which once exceeded the recursion limit
+_LONG_CHAINS = Case(
+        [(0,), (1,), (2,)], (0,),
+        {'m': (boolexpr.chain(And, [Rel(RelType.NOT_EQUAL, Variable(0),
+                                        Literal(i))
+                                    for i in range(2, 2002)]),
+               boolexpr.chain(Or, [Rel(RelType.EQUAL, Variable(0),
+                                       Literal(i))
+                                   for i in range(-1999, 2)]))})
+REGRESSIONS['satisfies'].append(_LONG_CHAINS)
+REGRESSIONS['graph'].append(_LONG_CHAINS)
+# the poststate (2,) of m has no transitions
+REGRESSIONS['affected'].append(Case(
+        [(0,), (1,), (2,)], (0,),
+        {'m': (Rel(RelType.EQUAL, Variable(0), Literal(0)),
+               Rel(RelType.EQUAL, Variable(0), Literal(2))),
+         'n': (Rel(RelType.EQUAL, Variable(0), Literal(0)),
+               Rel(RelType.EQUAL, Variable(0), Literal(1)))}))
+# m loses all transitions, but its poststate isn't a sink
+REGRESSIONS['affected'].append(Case(
+        [(0,), (1,)], (0,),
+        {'m': (Rel(RelType.EQUAL, Variable(0), Literal(0)),
+               Rel(RelType.EQUAL, Variable(0), Literal(1))),
+         'k': (Rel(RelType.EQUAL, Variable(0), Literal(1)),
+               Rel(RelType.EQUAL, Variable(0), Literal(1)))}))
+
+
+# Shrinking #
+
+def _smaller_exprs(expr):
+    """Yield expressions that are simpler than `expr`."""
+    match expr:
+        case And(l, r) | Or(l, r):
+            yield l
+            yield r
+            for smaller in _smaller_exprs(l):
+                yield type(expr)(smaller, r)
+            for smaller in _smaller_exprs(r):
+                yield type(expr)(l, smaller)
+        case Not(e):
+            yield e
+            for smaller in _smaller_exprs(e):
+                yield Not(smaller)
+        case Rel(kind, left, right):
+            yield BoolTrue()
+            if kind != RelType.EQUAL:
+                yield Rel(RelType.EQUAL, left, right)
+        case BoolFalse():
+            yield BoolTrue()
+
+
+def _smaller_cases(case: Case):
+    """Yield cases that are simpler than `case`, the simplest first."""
+    for name in case.methods:
+        methods = {k: v for k, v in case.methods.items() if k != name}
+        yield dataclasses.replace(case, methods=methods)
+    for state in case.possible_states:
+        if state == case.initial_state:
+            continue
+        states = [s for s in case.possible_states if s != state]
+        yield dataclasses.replace(case, possible_states=states)
+    for name, (pre, post) in case.methods.items():
+        for smaller in _smaller_exprs(pre):
+            yield dataclasses.replace(
+                    case, methods=case.methods | {name: (smaller, post)})
+        for smaller in _smaller_exprs(post):
+            yield dataclasses.replace(
+                    case, methods=case.methods | {name: (pre, smaller)})
+
+
+def shrink(check, engine, case: Case) -> Case:
+    """
+    Greedily simplify the failing `case` for as long as `check` keeps
+    failing on it; return the minimal case.
+    """
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for smaller in _smaller_cases(case):
+            if check(engine, smaller) is not None:
+                case, shrunk = smaller, True
+                break
+    return case
+
+
+@dataclasses.dataclass
+class Failure:
+    kind: str
+    engine: str
+    case: Case
+    message: str
+
+
+def run(kinds=None, cases=100, seed=0, **sizes) -> list[Failure]:
+    """
+    Check every registered engine of `kinds` (all by default) on the models
+    of `REGRESSIONS` and `cases` random models; return the failures, at most
+    one per engine. Failures on random models are shrunk. `sizes` are passed
+    on to `random_case`.
+    """
+    failures = []
+    for kind in kinds or ENGINES:
+        check = CHECKS[kind]
+        for name, engine in ENGINES[kind].items():
+            failure = next((case for case in REGRESSIONS[kind]
+                            if check(engine, case) is not None), None)
+            if failure is not None:
+                failures.append(Failure(kind, name, failure,
+                                        check(engine, failure)))
+                continue
+            rng = random.Random(seed)
+            for _ in range(cases):
+                case = random_case(rng, **sizes)
+                if check(engine, case) is None:
+                    continue
+                case = shrink(check, engine, case)
+                failures.append(Failure(kind, name, case,
+                                        check(engine, case)))
+                break
+    return failures
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('--cases', type=int, default=100)
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--variables', type=int, default=2)
+    argparser.add_argument('--domain', type=int, default=2)
+    argparser.add_argument('--methods', type=int, default=3)
+    argparser.add_argument('kinds', nargs='*', metavar='kind',
+                           help=f'kinds of engines to check: '
+                                f'{", ".join(ENGINES)} (default: all)')
+    args = argparser.parse_args(argv)
+    for kind in args.kinds:
+        if kind not in ENGINES:
+            argparser.error(f'unknown kind {kind!r}')
+    failures = run(args.kinds, args.cases, args.seed,
+                   variables=args.variables, domain=args.domain,
+                   methods=args.methods)
+    for f in failures:
+        print(f'{f.kind} engine {f.engine!r} disagrees with the reference:')
+        print(f'  {f.message}')
+        print(f'  states: {f.case.possible_states}')
+        print(f'  initial state: {f.case.initial_state}')
+        for method, (pre, post) in f.case.methods.items():
+            print(f'  {method}: requires {pre}')
+            print(f'  {" " * len(method)}  ensures {post}')
+    if failures:
+        raise SystemExit(1)
+    print('no disagreements')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+r"""
+Conversion of JML expressions in the tree-sitter syntax tree into `boolexpr`
+objects.
+
+The tree is walked with an explicit stack instead of recursion. Chains of
+`&&`, `||` and `==>` are converted into balanced trees of `And` and `Or` (see
+`boolexpr.chain`), whose depth only grows logarithmically with their length,
+so that the recursive functions processing the result, like hashing,
+`boolexpr.canonical` and `boolexpr.satisfies`, handle chains of any length.
+Only other kinds of deep nesting, like thousands of nested parentheses
+alternating `&&` and `||`, still exceed Python's recursion limit.
+
+Every node is interned in a table passed in by the caller, e.g. one per file:
+equal subexpressions converted with the same table are the same object. Since
+children are interned before their parents, a node is looked up by the
+identities of its children, so interning costs constant time per node and the
+whole conversion is one linear pass. The table keeps the interned objects
+alive, so their identities can't be reused while it exists.
+
+Names are looked up in an optional symbol table, e.g. to map ghost variables
+to their ids; other names become `Variable(name)`, and `Old(name)` inside
+`\old(...)`. Expressions outside the modeled subset, like method calls, become
+opaque variables named after their source text, so that clauses mentioning
+them can be recognized and left out. Booleans used as values are 1 and 0, and
+values used as conditions are compared to 0, so that boolean ghost variables
+are modeled like integer ones.
+"""
+
+import functools
+
+import boolexpr
+from boolexpr import (And, Or, Not, BoolTrue, BoolFalse, Rel, RelType,
+                      ArithType, Value, BoolExpr, Variable, Old, Literal)
+
+_RELATIONS = {
+    '==': RelType.EQUAL,
+    '!=': RelType.NOT_EQUAL,
+    '<': RelType.LESS_THAN,
+    '<=': RelType.LESS_EQUAL,
+    '>': RelType.GREATER_THAN,
+    '>=': RelType.GREATER_EQUAL,
+}
+
+_CONNECTIVES = frozenset(('&&', '||', '==>', '<==', '<==>', '<=!=>'))
+
+# connectives whose chains are converted into balanced trees
+_CHAINS = frozenset(('&&', '||', '==>'))
+
+_ARITHMETIC = {
+    '+': ArithType.ADD,
+    '-': ArithType.SUB,
+    '*': ArithType.MUL,
+    '/': ArithType.DIV,
+    '%': ArithType.MOD,
+}
+
+_INTEGER_LITERALS = {
+    'decimal_integer_literal': 10,
+    'hex_integer_literal': 16,
+    'octal_integer_literal': 8,
+    'binary_integer_literal': 2,
+}
+
+# Named node types that the conversion relies on, checked against the grammar
+# by `parser.check_grammar`. \old(...) isn't among them: it is recognized by
+# its leading `\old` keyword, whatever the grammar names the node.
+NODE_TYPES = frozenset((
+    'binary_expression', 'unary_expression', 'parenthesized_expression',
+    'identifier', 'field_access', 'this', 'true', 'false',
+    *_INTEGER_LITERALS))
+
+
+def _is_old(node):
+    return node.child_count > 0 and node.children[0].type == '\\old'
+
+
+def _intern(table, expr):
+    """
+    Return the object equal to `expr` in `table`, adding it if there is none.
+    The children of `expr` must be from `table` already.
+    """
+    key = (type(expr),) + tuple(
+            id(x) if isinstance(x, (Value, BoolExpr)) else x
+            for x in (getattr(expr, slot) for slot in expr.__slots__))
+    return table.setdefault(key, expr)
+
+
+def _operator(node):
+    operator = node.child_by_field_name('operator')
+    return None if operator is None else operator.type
+
+
+def _chain(node):
+    """
+    Return the operands of the chain of binary expressions with the operator
+    of `node` that `node` is the top of, in source order. Chains of `==>`
+    continue in right operands only, since it is right-associative.
+    """
+    operator = _operator(node)
+    operands = []
+    todo = [node]
+    while todo:
+        n = todo.pop()
+        left = n.child_by_field_name('left')
+        right = n.child_by_field_name('right')
+        if (n.type != 'binary_expression' or _operator(n) != operator
+                or left is None or right is None):
+            operands.append(n)
+        elif operator == '==>':
+            operands.append(left)
+            todo.append(right)
+        else:
+            todo += (right, left)
+    return operands
+
+
+def _children(node):
+    """Return the subexpressions of `node` that are converted first."""
+    match node.type:
+        case 'binary_expression' if _operator(node) in _CHAINS:
+            children = _chain(node)
+        case 'binary_expression':
+            children = [node.child_by_field_name('left'),
+                        node.child_by_field_name('right')]
+        case 'unary_expression':
+            children = [node.child_by_field_name('operand')]
+        case 'parenthesized_expression':
+            children = node.named_children[:1]
+        case _ if _is_old(node):
+            children = node.named_children[:1]
+        case _:
+            children = []
+    # incomplete nodes of erroneous sources may lack children
+    return [child for child in children if child is not None]
+
+
+def _opaque(node, to_str, intern):
+    return intern(Variable(to_str(node)))
+
+
+def _as_bool(x, intern):
+    """Return `x` for use as an operand of a boolean operator."""
+    if isinstance(x, BoolExpr):
+        return x
+    return intern(Rel(RelType.NOT_EQUAL, x, intern(Literal(0))))
+
+
+def _as_value(x, node, to_str, intern):
+    """
+    Return `x`, the expression of `node`, for use as an operand of a
+    comparison or arithmetic.
+    """
+    match x:
+        case Value():
+            return x
+        case BoolTrue():
+            return intern(Literal(1))
+        case BoolFalse():
+            return intern(Literal(0))
+    return _opaque(node, to_str, intern)
+
+
+def _name(name, old, symbols):
+    value = symbols.get(name) if symbols is not None else None
+    match value, old:
+        case None, False:
+            return Variable(name)
+        case None, True:
+            return Old(name)
+        case Variable(i), True:
+            return Old(i)
+    return value
+
+
+def _integer(text, base):
+    text = text.replace('_', '').rstrip('lL')
+    if base != 10 and base != 8:
+        text = text[2:]
+    return int(text, base)
+
+
+def _leaf(node, old, to_str, symbols):
+    match node.type:
+        case 'identifier':
+            return _name(to_str(node), old, symbols)
+        case 'true':
+            return BoolTrue()
+        case 'false':
+            return BoolFalse()
+        case 'field_access' if node.child_by_field_name('field') is not None \
+                and node.child_by_field_name('object').type == 'this':
+            return _name(to_str(node.child_by_field_name('field')), old,
+                         symbols)
+        case t if t in _INTEGER_LITERALS:
+            return Literal(_integer(to_str(node), _INTEGER_LITERALS[t]))
+    return Variable(to_str(node))
+
+
+def _combine(node, children, args, to_str, intern):
+    """
+    Build the expression of `node` from those of its children `children`,
+    `args`.
+    """
+    if node.type == 'binary_expression' and _operator(node) in _CHAINS:
+        return _combine_chain(_operator(node),
+                              [_as_bool(x, intern) for x in args], intern)
+    if len(args) != (2 if node.type == 'binary_expression' else 1):
+        return _opaque(node, to_str, intern)
+    match node.type:
+        case 'parenthesized_expression':
+            return args[0]
+        case _ if _is_old(node):
+            return args[0]
+        case 'unary_expression':
+            operator = node.child_by_field_name('operator').type
+            [x] = args
+            match operator:
+                case '!':
+                    return Not(_as_bool(x, intern))
+                case '-':
+                    return boolexpr.arith(
+                            ArithType.SUB, intern(Literal(0)),
+                            _as_value(x, children[0], to_str, intern))
+                case '+':
+                    return _as_value(x, children[0], to_str, intern)
+        case 'binary_expression':
+            operator = node.child_by_field_name('operator').type
+            left, right = args
+            if operator in _CONNECTIVES:
+                left, right = _as_bool(left, intern), _as_bool(right, intern)
+            elif operator in _RELATIONS or operator in _ARITHMETIC:
+                left = _as_value(left, children[0], to_str, intern)
+                right = _as_value(right, children[1], to_str, intern)
+            match operator:
+                case '<==':
+                    return Or(left, intern(Not(right)))
+                case '<==>' | '<=!=>':
+                    equivalence = And(
+                            intern(Or(intern(Not(left)), right)),
+                            intern(Or(left, intern(Not(right)))))
+                    if operator == '<==>':
+                        return equivalence
+                    return Not(intern(equivalence))
+                case op if op in _RELATIONS:
+                    return Rel(_RELATIONS[op], left, right)
+                case op if op in _ARITHMETIC:
+                    return boolexpr.arith(_ARITHMETIC[op], left, right)
+    return _opaque(node, to_str, intern)
+
+
+def _combine_chain(operator, operands, intern):
+    """
+    Build the expression of a chain of `operator` (see `_chain`) from those
+    of its operands as a balanced tree (see `boolexpr.chain`).
+    """
+    match operator:
+        case '&&':
+            kind = And
+        case '||':
+            kind = Or
+        case '==>':
+            # a ==> b ==> c is !a || !b || c
+            kind = Or
+            operands = ([intern(Not(x)) for x in operands[:-1]]
+                        + operands[-1:])
+    return boolexpr.chain(kind, operands,
+                          lambda left, right: intern(kind(left, right)))
+
+
+def parse_expression(node, to_str, symbols=None, interned=None):
+    r"""
+    Return the `boolexpr` expression or value of the syntax tree `node`.
+
+    `to_str` returns the source text of a node. `symbols` maps names to the
+    values they stand for; a `Variable` value becomes `Old` inside \old().
+    Subexpressions are interned in the dict `interned`, by default in a new
+    one for this expression only.
+    """
+    intern = functools.partial(_intern, {} if interned is None else interned)
+    return _convert(node, to_str, symbols, intern)
+
+
+def parse_value(node, to_str, symbols=None, interned=None):
+    """
+    Like `parse_expression`, but return a value, e.g. for the initial value
+    of a ghost variable: `true` and `false` become 1 and 0, other boolean
+    expressions opaque variables.
+    """
+    intern = functools.partial(_intern, {} if interned is None else interned)
+    return _as_value(_convert(node, to_str, symbols, intern), node, to_str,
+                     intern)
+
+
+def parse_condition(node, to_str, symbols=None, interned=None):
+    """
+    Like `parse_expression`, but return a boolean expression, e.g. for a
+    contract clause: a value v becomes v != 0, so that boolean ghost
+    variables can be used as conditions.
+    """
+    intern = functools.partial(_intern, {} if interned is None else interned)
+    return _as_bool(_convert(node, to_str, symbols, intern), intern)
+
+
+def _convert(node, to_str, symbols, intern):
+    results = []
+    # entries (node, inside \old, children done)
+    stack = [(node, False, False)]
+    while stack:
+        n, old, done = stack.pop()
+        if done:
+            children = _children(n)
+            args = results[len(results) - len(children):]
+            del results[len(results) - len(children):]
+            results.append(intern(_combine(n, children, args, to_str,
+                                           intern)))
+            continue
+        children = _children(n)
+        if not children:
+            results.append(intern(_leaf(n, old, to_str, symbols)))
+            continue
+        stack.append((n, old, True))
+        child_old = old or _is_old(n)
+        for child in reversed(children):
+            stack.append((child, child_old, False))
+    [result] = results
+    return result
@@ -1,19 +1,108 @@
+import functools
 import itertools
 import boolexpr
+import instrument
 
 
 def from_program(possible_states,
                  methods: dict[str, (boolexpr.BoolExpr, boolexpr.BoolExpr)],
-                 satisfies=boolexpr.satisfies):
+                 satisfies=None):
     """
     Return a graph with transitions prestate--method-->poststate from all
     possible prestates of a method to all its possible poststates. Possible
-    transitions are determined with the function `satisfies`.
+    transitions are determined with the function `satisfies`, by default
+    with contracts compiled by `boolexpr.compile_expr`.
+
+    Contracts are split into their canonical clauses, and the states
+    satisfying each distinct clause are computed only once for all methods.
 
     The graph is of type dict[state->dict[method->state]].
     """
     graph = {}
-    print(possible_states)
+    if instrument.enabled():
+        instrument.count('states', len(possible_states))
+
+    def checker(expr):
+        if satisfies is None:
+            check = boolexpr.compile_expr(expr)
+        else:
+            def check(state, prestate=None):
+                return satisfies(state, expr, prestate)
+        if instrument.enabled():
+            check = instrument.counted('satisfies', check)
+        return check
+
+    # indices of the states satisfying each canonical clause
+    clause_states = {}
+    all_indices = frozenset(range(len(possible_states)))
+
+    def clause_satisfying(clause):
+        if clause not in clause_states:
+            check = checker(clause)
+            clause_states[clause] = frozenset(
+                    i for i, state in enumerate(possible_states)
+                    if check(state))
+        return clause_states[clause]
+
+    def clauses(x):
+        x = boolexpr.canonical(x)
+        # clauses that may fail are guarded by the preceding ones
+        return [x] if boolexpr.may_fail(x) else boolexpr.conjuncts(x)
+
+    def satisfying_all(parts):
+        indices = functools.reduce(frozenset.intersection,
+                                   map(clause_satisfying, parts), all_indices)
+        return [possible_states[i] for i in sorted(indices)]
+
+    def satisying_states(x):
+        return satisfying_all(clauses(x))
+
+    def valid_transitions(precond, postcond):
+        pres = satisying_states(precond)
+        parts = clauses(postcond)
+        posts = satisfying_all([c for c in parts if not c.contains_old()])
+        old = [c for c in parts if c.contains_old()]
+        if not old:
+            return itertools.product(pres, posts)
+        check = checker(boolexpr.canonical(boolexpr.chain(boolexpr.And, old)))
+        return [(pre, post)
+                for pre in pres
+                for post in posts
+                if check(post, pre)]
+
+    with instrument.stage('graph'):
+        for name, (precond, postcond) in methods.items():
+            if not postcond.contains_old():
+                pres_posts = itertools.product(
+                        satisying_states(precond),
+                        satisying_states(postcond))
+            else:
+                pres_posts = valid_transitions(precond, postcond)
+
+            for pre, post in pres_posts:
+                if pre not in graph:
+                    graph[pre] = {}
+                if name not in graph[pre]:
+                    graph[pre][name] = []
+                graph[pre][name].append(post)
+
+    if instrument.enabled():
+        instrument.count('edges', sum(len(posts)
+                                      for transitions in graph.values()
+                                      for posts in transitions.values()))
+    return graph
+
+
+def from_program_reference(possible_states,
+                           methods: dict[str, (boolexpr.BoolExpr,
+                                               boolexpr.BoolExpr)],
+                           satisfies=boolexpr.satisfies):
+    """
+    Like `from_program`, but checking every contract on every state as it is
+    written. Slow; this is the reference the other graph engines are tested
+    against.
+    """
+    graph = {}
 
     def satisying_states(x):
         return [state for state in possible_states
@@ -42,3 +131,68 @@ def from_program(possible_states,
             graph[pre][name].append(post)
 
     return graph
+
+
+def remove_methods(graph, names):
+    """Remove all transitions labeled with a method in `names` from `graph`."""
+    for pre in list(graph):
+        for name in names:
+            graph[pre].pop(name, None)
+        if not graph[pre]:
+            del graph[pre]
+
+
+def update_methods(graph, possible_states, methods, names, satisfies=None):
+    """
+    Recompute the transitions of the methods `names` in `graph` in place. Only
+    the contracts of these methods in `methods` are evaluated. Methods in
+    `names` missing from `methods` lose all their transitions.
+    """
+    remove_methods(graph, names)
+    changed = {name: methods[name] for name in names if name in methods}
+    for pre, transitions in from_program(possible_states, changed,
+                                         satisfies).items():
+        graph.setdefault(pre, {}).update(transitions)
+    return graph
+
+
+def _merged(*graphs):
+    """Return a graph with the transitions of all `graphs`."""
+    result = {}
+    for g in graphs:
+        for pre, transitions in g.items():
+            for name, posts in transitions.items():
+                result.setdefault(pre, {}).setdefault(name, set()).update(posts)
+    return result
+
+
+def affected_methods(old_graph, new_graph, initial_state, changed):
+    """
+    Return the methods whose pretraces may differ between `old_graph` and
+    `new_graph`, given that only transitions of the methods `changed` differ:
+    the methods `changed` themselves, which may have lost all transitions, and
+    those callable in a state reachable through a changed transition.
+    """
+    union = _merged(old_graph, new_graph)
+    starts = reachable(union, [initial_state])
+    targets = {post
+               for pre in starts
+               for name in changed
+               for post in union.get(pre, {}).get(name, ())}
+    result = set(changed)
+    for state in reachable(union, targets):
+        result.update(union.get(state, {}))
+    return result
+
+
+def reachable(graph, starts):
+    """Return the set of states reachable in `graph` from the states `starts`."""
+    result = set(starts)
+    todo = list(result)
+    while todo:
+        for posts in graph.get(todo.pop(), {}).values():
+            for post in posts:
+                if post not in result:
+                    result.add(post)
+                    todo.append(post)
+    return result
@@ -0,0 +1,182 @@
+"""
+Binary file format for state transition graphs, read through `mmap`.
+
+A graph of `graph.from_program` is written once with `write` and opened with
+`GraphFile`, a read-only mapping of the same shape as the dict graph, i.e.
+state -> {method -> [poststates]}. Nothing is read until it is accessed, so
+opening even huge graphs is instant, and processes opening the same file share
+its pages. Functions that iterate over graphs, like `cats.something`,
+`cats.naive_pretrace_from_graph` and `regex.to_regex_graph`, accept it in place
+of a dict.
+
+States must be tuples of integers of the same length. The file consists of a
+header and these sections, each aligned to 8 bytes (all little-endian; on
+big-endian machines, the sections are byteswapped into memory on opening):
+  states         int64[states][width], first those with transitions, in the
+                 order of the graph
+  name offsets   uint32[methods + 1] into the name bytes
+  names          UTF-8 method names
+  row pointers   uint64[methods][keys + 1] into the columns (CSR), where keys
+                 is the number of states with transitions
+  columns        uint32[edges], the poststate indices
+"""
+
+import array
+import collections.abc
+import mmap
+import struct
+import sys
+
+MAGIC = b'JMLG'
+VERSION = 1
+
+# magic, version, states, keys, width, methods, edges, section offsets
+_HEADER = struct.Struct('<4sIIIIIQ5Q')
+
+
+def _pad(file):
+    file.write(b'\0' * (-file.tell() % 8))
+
+
+def _write_array(file, a):
+    if sys.byteorder != 'little':
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    file.write(a.tobytes())
+
+
+def write(path, g):
+    """Write the graph `g` to the file at `path`."""
+    keys = list(g)
+    index = {state: i for i, state in enumerate(keys)}
+    methods = {}
+    for transitions in g.values():
+        for method, posts in transitions.items():
+            methods.setdefault(method, None)
+            for post in posts:
+                index.setdefault(post, len(index))
+    states = list(index)
+    width = len(states[0]) if states else 0
+    if any(len(s) != width for s in states):
+        raise ValueError('states must be tuples of the same length')
+    if not all(isinstance(method, str) for method in methods):
+        raise ValueError('method names must be strings')
+
+    pointers = array.array('Q')
+    columns = array.array('I')
+    for method in methods:
+        pointers.append(len(columns))
+        for state in keys:
+            columns.extend(index[post] for post in g[state].get(method, ()))
+            pointers.append(len(columns))
+    names = [method.encode('utf-8') for method in methods]
+    name_offsets = array.array('I', [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    with open(path, 'wb') as file:
+        file.write(b'\0' * _HEADER.size)
+        offsets = []
+        for write_section in (
+                lambda: _write_array(file, array.array(
+                    'q', (v for s in states for v in s))),
+                lambda: _write_array(file, name_offsets),
+                lambda: file.write(b''.join(names)),
+                lambda: _write_array(file, pointers),
+                lambda: _write_array(file, columns)):
+            _pad(file)
+            offsets.append(file.tell())
+            write_section()
+        file.seek(0)
+        file.write(_HEADER.pack(MAGIC, VERSION, len(states), len(keys), width,
+                                len(methods), len(columns), *offsets))
+
+
+class _Items(collections.abc.ItemsView):
+    def __iter__(self):
+        graph = self._mapping
+        for i in range(len(graph)):
+            yield graph.state(i), graph.transitions(i)
+
+
+class GraphFile(collections.abc.Mapping):
+    """Read-only view of a graph file, see the module documentation."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        try:
+            self._read_sections()
+        except BaseException:
+            self.close()
+            raise
+        self._index = None
+
+    def _read_sections(self):
+        magic, version, n_states, self._keys, self.width, n_methods, n_edges, \
+                *offsets = _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.path}: not a graph file of version '
+                             f'{VERSION}')
+        view = memoryview(self._mmap)
+        self._views.append(view)
+        def section(i, typecode, count):
+            size = struct.calcsize(typecode) * count
+            data = view[offsets[i] : offsets[i] + size]
+            if sys.byteorder == 'little':
+                data = data.cast(typecode)
+                self._views.append(data)
+                return data
+            a = array.array(typecode)
+            a.frombytes(data)
+            a.byteswap()
+            return a
+        self._states = section(0, 'q', n_states * self.width)
+        name_offsets = section(1, 'I', n_methods + 1)
+        names = bytes(view[offsets[2] : offsets[2] + name_offsets[-1]])
+        self.methods = [names[a:b].decode('utf-8')
+                        for a, b in zip(name_offsets, name_offsets[1:])]
+        self._pointers = section(3, 'Q', n_methods * (self._keys + 1))
+        self._columns = section(4, 'I', n_edges)
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def state(self, i) -> tuple:
+        """Return the state with index `i`."""
+        return tuple(self._states[i * self.width : (i + 1) * self.width])
+
+    def transitions(self, i) -> dict:
+        """Return the transitions of the state with index `i` < len(self)."""
+        result = {}
+        row = self._keys + 1
+        for m, method in enumerate(self.methods):
+            start = self._pointers[m * row + i]
+            end = self._pointers[m * row + i + 1]
+            if start != end:
+                result[method] = [self.state(c)
+                                  for c in self._columns[start:end]]
+        return result
+
+    def __len__(self):
+        return self._keys
+
+    def __iter__(self):
+        return map(self.state, range(self._keys))
+
+    def __getitem__(self, state):
+        if self._index is None:
+            self._index = {s: i for i, s in enumerate(self)}
+        return self.transitions(self._index[state])
+
+    def items(self):
+        return _Items(self)
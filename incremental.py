@@ -0,0 +1,122 @@
+"""
+Incremental reanalysis of a source file that is being edited.
+
+After an edit, the file is reparsed reusing the previous syntax tree. Only the
+transitions of methods whose contracts changed are recomputed, and only the
+pretraces of methods callable after such a transition. Changes to ghost
+declarations or set statements, including those of constructors, change the
+state space and trigger a full analysis.
+"""
+
+import os
+import time
+
+import analysis
+import cats
+import graph
+import model
+import parser
+import regex
+
+
+class Session:
+    """
+    Analysis of one source file that is kept up to date with its edits.
+
+    `options` are passed on to `regex.from_graph`.
+    """
+    def __init__(self, code: bytes, **options):
+        self.options = options
+        self.source = parser.parse_bytes(code)
+        self.program = parser.program_from_tree(self.source)
+        self.analysis = analysis.analyse(model.from_program(self.program),
+                                         **options)
+
+    def edit(self, start_byte, old_end_byte, new_text: bytes) -> set[str]:
+        """
+        Replace the source code between `start_byte` and `old_end_byte` with
+        `new_text` and update the analysis. Return the methods whose pretraces
+        were recomputed.
+        """
+        self.source = parser.reparse(self.source, start_byte, old_end_byte,
+                                     new_text)
+        return self._update()
+
+    def replace(self, code: bytes) -> set[str]:
+        """
+        Like `edit`, but with the complete new source code. The edit is the
+        span between the common prefix and suffix of old and new code.
+        """
+        old = self.source.code
+        start = 0
+        limit = min(len(old), len(code))
+        while start < limit and old[start] == code[start]:
+            start += 1
+        end = 0
+        while (end < limit - start
+               and old[len(old) - end - 1] == code[len(code) - end - 1]):
+            end += 1
+        if start == len(old) == len(code):
+            return set()
+        return self.edit(start, len(old) - end,
+                         code[start : len(code) - end])
+
+    def _update(self):
+        # the program is only kept once its analysis is, so that an edit
+        # that fails, e.g. in model.from_program, fails again when repeated
+        program = parser.program_from_tree(self.source)
+        old_program = self.program
+        if program == old_program:
+            return set()
+
+        old = self.analysis
+        new_model = model.from_program(program)
+        if (program.ghosts != old_program.ghosts
+                or program.ghost_constants != old_program.ghost_constants
+                or program.assignments != old_program.assignments
+                or program.constructors != old_program.constructors
+                or new_model[:3] != old.model[:3]):
+            self.analysis = analysis.analyse(new_model, **self.options)
+            self.program = program
+            return set(self.analysis.pretraces)
+
+        _, possible_states, initial_state, methods = new_model
+        old_methods = old.model[3]
+        changed = {name for name in methods.keys() | old_methods.keys()
+                   if methods.get(name) != old_methods.get(name)}
+
+        g = {pre: dict(transitions) for pre, transitions in old.graph.items()}
+        graph.update_methods(g, possible_states, methods, changed)
+        affected = graph.affected_methods(old.graph, g, initial_state, changed)
+        affected |= methods.keys() - old.pretraces.keys()
+
+        reachable = graph.reachable(g, [initial_state])
+        options = regex.shared_options(g, initial_state, self.options)
+        pretraces = {name: old.pretraces.get(name) for name in methods}
+        for name in affected & methods.keys():
+            pretraces[name] = analysis.pretrace(
+                    g, initial_state, name, reachable, **options)
+        naive = cats.naive_pretrace_from_graph(g, list(methods), initial_state)
+        self.analysis = analysis.Analysis(new_model, g, naive, pretraces)
+        self.program = program
+        return affected & methods.keys()
+
+
+def watch(path, callback, interval=0.1, **options):
+    """
+    Analyse the file at `path`, then poll it every `interval` seconds and
+    reanalyse it incrementally whenever it changes. After each analysis,
+    `callback(session, recomputed_methods)` is called. Runs until interrupted.
+    """
+    with open(path, 'rb') as file:
+        session = Session(file.read(), **options)
+    callback(session, set(session.analysis.pretraces))
+    mtime = os.stat(path).st_mtime_ns
+    while True:
+        time.sleep(interval)
+        current = os.stat(path).st_mtime_ns
+        if current == mtime:
+            continue
+        mtime = current
+        with open(path, 'rb') as file:
+            callback(session, session.replace(file.read()))
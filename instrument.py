@@ -0,0 +1,127 @@
+"""
+Stage timers, counters and peak-memory samples for finding out where the
+pipeline spends its time.
+
+Everything is a no-op until `enable` is called: `stage` returns a shared null
+context and `count` returns immediately. Hot loops should not call `count`
+per iteration; they wrap the counted function with `counted` when `enabled()`
+instead, so they pay nothing when instrumentation is off.
+
+Peak memory is sampled with `tracemalloc`, which slows down allocation-heavy
+code several times over. It is therefore off unless requested, and times
+taken while it is on are not representative. `tracemalloc` is only imported
+then.
+"""
+
+import contextlib
+import functools
+import time
+
+_enabled = False
+_trace_memory = False
+# peaks of the open stages, innermost last
+_open_peaks = []
+
+timers = {}
+counters = {}
+peak_memory = {}
+
+_NULL = contextlib.nullcontext()
+
+
+def enable(memory=False):
+    """
+    Start collecting; with `memory`, also sample peak memory per stage,
+    which distorts the times (see the module documentation).
+    """
+    global _enabled, _trace_memory
+    _enabled, _trace_memory = True, memory
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if _trace_memory:
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    timers.clear()
+    counters.clear()
+    peak_memory.clear()
+
+
+def count(name, n=1):
+    """Add `n` to the counter `name`."""
+    if _enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+def counted(name, func):
+    """Return `func` wrapped to count its calls under `name`."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        counters[name] = counters.get(name, 0) + 1
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def _sample_peak():
+    """
+    Fold the peak traced since the last sample into those of all open stages
+    and start a new sampling period.
+    """
+    import tracemalloc # only sampled when enabled with memory
+    _, peak = tracemalloc.get_traced_memory()
+    for i, open_peak in enumerate(_open_peaks):
+        _open_peaks[i] = max(open_peak, peak)
+    tracemalloc.reset_peak()
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _trace_memory:
+            _sample_peak()
+            _open_peaks.append(0)
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_):
+        elapsed = time.perf_counter() - self.start
+        calls, total = timers.get(self.name, (0, 0.0))
+        timers[self.name] = (calls + 1, total + elapsed)
+        if _trace_memory:
+            _sample_peak()
+            peak = _open_peaks.pop()
+            peak_memory[self.name] = max(peak_memory.get(self.name, 0), peak)
+
+
+def stage(name):
+    """
+    Context manager timing a stage of the pipeline. Times of stages with the
+    same name add up. With memory sampling, the peak memory of every stage,
+    including nested ones, is recorded too.
+    """
+    return _Stage(name) if _enabled else _NULL
+
+
+def stats() -> dict:
+    """Return everything collected so far as a JSON-serializable dict."""
+    return {
+        'timers': {name: {'calls': calls, 'seconds': round(total, 6)}
+                   for name, (calls, total) in timers.items()},
+        'counters': dict(counters),
+        'peak_memory_bytes': dict(peak_memory),
+    }
@@ -37,4 +37,8 @@ class Invariant:
 @dataclass
 class Assignment:
     variable: ...
+    value: ...
+    # True if the statement might not be executed, e.g. inside an if or after
+    # a return inside an if
+    conditional: bool = False
     
@@ -1,8 +1,40 @@
 #! .venv/bin/python
+"""
+Run stages of the pipeline on models from `cases.py` or on annotated source
+files, e.g.
+  main.py regex imagine casino
+  main.py --format jsonl graph src/
+  main.py --cache .jml-cache regex src/
+Results are written as soon as they are available: per method for the
+`witness`, `cats` and `regex` stages, per input otherwise. The `witness` stage
+gives the shortest call sequences after which each method may be called.
+"""
+import argparse
+import dataclasses
 import importlib.util
-_parser_spec = importlib.util.find_spec("tree_sitter_java")
-if _parser_spec is None:
-    print(
+import inspect
+import json
+import os
+import sys
+
+import analysis
+import cases
+import cats
+import graph
+import instrument
+import regex
+
+STAGES = ('parse', 'model', 'graph', 'witness', 'cats', 'regex')
+
+
+def _require_parser():
+    """
+    Quit with instructions if the local parser module is missing. Only checked
+    when sources are parsed, so runs on models from `cases.py` don't load the
+    parser stack at all.
+    """
+    if importlib.util.find_spec("tree_sitter_java") is None:
+        print(
 """
 Local parser module 'tree-sitter-java' is not installed.
 Run either
@@ -12,57 +44,261 @@ or
   ./.venv/bin/pip install -r requirements.txt
 first.
 """)
-    quit(1)
-del _parser_spec
-
-import sys
+        quit(1)
 
-import collections
-import itertools
-import functools
 
-import cats
-import regex
-import boolexpr
-import graph
-import cases
+def case_names():
+    """Return the names of all models in `cases.py`."""
+    return [name for name, func in inspect.getmembers(cases, inspect.isfunction)
+            if func.__module__ == cases.__name__ and not name.startswith('_')]
 
 
-def main():
-    variables, possible_states, initital_state, methods =\
-            cases.imagine()
-    g = graph.from_program(
-            possible_states,
-            methods)
-    print(g)
-    r, f = cats.something(g)
-    print(r)
-    print(f)
-
-    method_names = list(methods.keys())
-
-    cat = cats.naive_pretrace_from_graph(g, method_names, initital_state)
-
-    for method in method_names:
-        print(f'\n{method=}\n')
-        print(f'naive cat:\n {cat[method]}\n')
-        r = regex.from_graph(g, initital_state, method)
-        print(f'regex:\n {r}\n')
-        c = regex.collapse_same_prefix(r)
-        print(f'simpler:\n {c}\n')
-        m = list(map(str, regex.must_contain(r)))
-        print(f'must contain:\n {m}\n')
-        l = [str(x) for x in regex.last_calls(r)]
-        print(f'traces end with:\n {l}\n')
-
-from boolexpr import *
-
-def main():
+def _inputs(names, cache_directory=None, **options):
+    """
+    Yield (input name, program or None, model, analysis or None, error) for
+    each of `names`: a model from `cases.py`, a source file or a directory of
+    source files. With `cache_directory`, the analyses of source files are
+    read from or added to the `cache.Cache` there; `options` are those of the
+    analysis. If a program has no model, e.g. because its constructors may
+    leave the state variables in different states, the model is None and
+    `error` says why; otherwise `error` is None.
+    """
+    known = case_names()
+    sources = []
+    for name in names:
+        if name in known:
+            yield name, None, getattr(cases, name)(), None, None
+        elif os.path.exists(name):
+            sources.append(name)
+        else:
+            raise SystemExit(f'{name}: neither a model in cases.py nor a file')
+    if not sources:
+        return
+    _require_parser()
+    if cache_directory is not None:
+        import cache
+        for path, entry in cache.analyse_files(
+                sources, cache.Cache(cache_directory), **options):
+            if entry.error is not None:
+                yield path, entry.program, None, None, entry.error
+            else:
+                yield (path, entry.program, entry.analysis.model,
+                       entry.analysis, None)
+        return
+    import model
     import parser
-    example = './example.rjava'
-    parser.parse(example)
+    for path, program in parser.parse_many(sources):
+        try:
+            m = model.from_program(program)
+        except ValueError as e:
+            yield path, program, None, None, str(e)
+            continue
+        yield path, program, m, None, None
+
+
+def _jsonable(x):
+    match x:
+        case dict():
+            return {str(k): _jsonable(v) for k, v in x.items()}
+        case set() | frozenset():
+            return sorted(map(_jsonable, x), key=str)
+        case list() | tuple():
+            return list(map(_jsonable, x))
+        case str() | int() | float() | bool() | None:
+            return x
+        case _ if dataclasses.is_dataclass(x):
+            return str(x)
+    return str(x)
+
+
+def _edges(g):
+    return [(pre, method, post)
+            for pre, transitions in g.items()
+            for method, posts in transitions.items()
+            for post in posts]
+
+
+class _Output:
+    """Writes results either as JSON Lines or as readable text."""
+    def __init__(self, jsonl, file=sys.stdout):
+        self.jsonl = jsonl
+        self.file = file
+
+    def emit(self, record, text):
+        if self.jsonl:
+            self.file.write(json.dumps(_jsonable(record)) + '\n')
+        else:
+            self.file.write(text + '\n')
+        self.file.flush()
+
+
+def run(stage, name, program, m, out, symbolic=False, jobs=1, result=None,
+        error=None, **options):
+    """
+    Run the pipeline on one input up to `stage` and write the results. With
+    `symbolic`, the graph is built with BDDs over the reachable states only.
+    With `jobs` > 1, regex pretraces are computed by that many processes and
+    written in the order they are done. A precomputed `analysis.Analysis`
+    `result` of the input is used instead of recomputing its stages. If the
+    input has no model, the `error` saying why is written for the stages
+    after 'parse'.
+    """
+    record = {'input': name, 'stage': stage}
+    if error is not None and stage != 'parse':
+        out.emit(record | {'error': error}, f'{name}: {error}')
+        return
+    match stage:
+        case 'parse':
+            if program is None:
+                out.emit(record | {'error': 'not a source file'},
+                         f'{name}: not a source file')
+                return
+            fields = dataclasses.asdict(program)
+            out.emit(record | {'program': fields}, f'{name}:\n {program}\n')
+            return
+    variables, possible_states, initial_state, methods = m
+    match stage:
+        case 'model':
+            out.emit(record | {'variables': variables,
+                               'possible_states': possible_states,
+                               'initial_state': initial_state,
+                               'methods': methods},
+                     f'{name}:\n {variables=}\n {possible_states=}\n'
+                     f' {initial_state=}\n {methods=}\n')
+            return
+
+    if result is not None:
+        g = result.graph
+    elif symbolic:
+        import bdd # only needed with --symbolic
+        g = bdd.from_program(possible_states, methods, initial_state)
+    else:
+        g = graph.from_program(possible_states, methods)
+    if stage == 'graph':
+        prestates, preceders = cats.something(g)
+        out.emit(record | {'edges': _edges(g)},
+                 f'{name}:\n {g}\n {prestates}\n {preceders}\n')
+        return
+
+    if stage == 'witness':
+        import witness # only needed for this stage
+        w = witness.Witnesses(g, initial_state)
+        for method in methods:
+            shortest = w.witness(method)
+            prestates = w.prestate_witnesses(method)
+            out.emit(record | {'method': method, 'witness': shortest,
+                               'prestates': list(prestates.items())},
+                     f'{name} {method=}\n'
+                     + (' never callable\n' if shortest is None else
+                        f' shortest witness:\n {list(shortest)}\n'
+                        ' per prestate:\n'
+                        + ''.join(f' {s}: {list(p)}\n'
+                                  for s, p in prestates.items())))
+        return
+
+    if stage == 'cats':
+        if result is not None:
+            naive = result.cats
+        else:
+            naive = cats.naive_pretrace_from_graph(g, list(methods),
+                                                   initial_state)
+        for method in methods:
+            cat = naive.get(method)
+            out.emit(record | {'method': method, 'cat': cat},
+                     f'{name} {method=}\n naive cat:\n {cat}\n')
+        return
+
+    if result is not None:
+        pretraces = result.pretraces.items()
+    elif jobs > 1 and len(methods) > 1:
+        pretraces = analysis.parallel_pretraces(g, initial_state, methods,
+                                                jobs, **options)
+    else:
+        reachable = graph.reachable(g, [initial_state])
+        options = regex.shared_options(g, initial_state, options)
+        pretraces = ((method, analysis.pretrace(g, initial_state, method,
+                                                reachable, **options))
+                     for method in methods)
+    for method, p in pretraces:
+        if p is None:
+            out.emit(record | {'method': method, 'regex': None},
+                     f'{name} {method=}\n never callable\n')
+            continue
+        out.emit(record | {'method': method,
+                           'regex': p.regex,
+                           'simplified': p.simplified,
+                           'must_contain': p.must_contain,
+                           'last_calls': p.last_calls,
+                           'approximate': p.approximate},
+                 f'{name} {method=}\n'
+                 + (' over-approximated: regex size budget exceeded\n'
+                    if p.approximate else '')
+                 + f' regex:\n {p.regex}\n'
+                 f' simpler:\n {p.simplified}\n'
+                 f' must contain:\n {sorted(map(str, p.must_contain))}\n'
+                 f' traces end with:\n {sorted(map(str, p.last_calls))}\n')
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--format', choices=('text', 'jsonl'),
+                           default='text')
+    argparser.add_argument('--engine', choices=tuple(regex.ENGINES),
+                           default='elimination',
+                           help='regex generation engine')
+    argparser.add_argument('--budget', type=int, default=None,
+                           help='maximum regex size during state elimination '
+                                '(only with --engine elimination)')
+    argparser.add_argument('--symbolic', action='store_true',
+                           help='build the graph symbolically, over the '
+                                'reachable states only')
+    argparser.add_argument('--jobs', type=int, default=1,
+                           help='number of processes computing regex '
+                                'pretraces')
+    argparser.add_argument('--cache', metavar='DIR',
+                           help='reuse the analyses of unchanged source '
+                                'files stored in DIR, and store new ones')
+    argparser.add_argument('--stats', action='store_true',
+                           help='print timings and counters as JSON to '
+                                'stderr')
+    argparser.add_argument('--memory', action='store_true',
+                           help='with --stats, also sample peak memory per '
+                                'stage; slows down the run, so the timings '
+                                'are not representative')
+    argparser.add_argument('stage', choices=STAGES)
+    argparser.add_argument('inputs', nargs='*', default=['imagine'],
+                           metavar='input',
+                           help=f'models ({", ".join(case_names())}), '
+                                'source files or directories')
+    args = argparser.parse_args(argv)
+    if args.memory and not args.stats:
+        argparser.error('--memory requires --stats')
+    if args.budget is not None and args.engine != 'elimination':
+        argparser.error(f'--budget applies to state elimination only, '
+                        f'not to --engine {args.engine}')
+    if args.cache is not None and args.symbolic:
+        argparser.error('--cache stores graphs built explicitly, '
+                        'not with --symbolic')
+
+    options = {'engine': args.engine}
+    if args.budget is not None:
+        options['budget'] = args.budget
+    if args.stats:
+        instrument.enable(memory=args.memory)
+    out = _Output(args.format == 'jsonl')
+    # analyses are only worth caching for the stages after the model
+    cache_directory = (args.cache if STAGES.index(args.stage) > 1 else None)
+    inputs = _inputs(args.inputs, cache_directory, **options)
+    for name, program, m, result, error in inputs:
+        with instrument.stage(f'input {name}'):
+            run(args.stage, name, program, m, out, args.symbolic, args.jobs,
+                result, error, **options)
+    if args.stats:
+        json.dump(instrument.stats(), sys.stderr, indent=2)
+        sys.stderr.write('\n')
 
 
-# TODO make it that one can select which main function to run
 if __name__ == '__main__':
     main()
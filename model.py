@@ -0,0 +1,232 @@
+"""
+Translation of an extracted `parser.Program` into the state machine model
+used by `graph.from_program`, i.e. the same tuple as the examples in
+`cases.py`:
+  (variables, possible_states, initial_state, methods)
+
+State variables are the ghost variables whose initial value and assignments
+are all constants. Their possible values are exactly those constants. The
+initial state is the one left behind by construction: the declared initial
+values, changed by the set statements outside of methods (e.g. in initializer
+blocks) and then by those of the constructor. The possible states are the
+combinations of values that the set statements of the method bodies can
+produce from the initial state, which is usually far fewer than all
+combinations.
+"""
+
+import itertools
+
+import boolexpr
+import instrument
+import jml
+from boolexpr import BoolTrue, And, Variable, Old, Literal
+
+
+def _constant_values(program):
+    """Return the values of the ghost constants that are integer literals."""
+    constants = {}
+    for name, value in program.ghost_constants.items():
+        value = _resolve(value, constants)
+        if isinstance(value, Literal):
+            constants[name] = value
+    return constants
+
+
+def _resolve(value, constants):
+    """
+    Replace references to ghost constants in `value` with the constants'
+    values, folding arithmetic on them.
+    """
+    def aux(v):
+        match v:
+            case Variable(name) if name in constants:
+                return constants[name]
+        return v
+    return boolexpr.map_values(value, aux)
+
+
+def state_variables(program) -> dict[str, set[int]]:
+    """
+    Return the state variables of `program` mapped to all values they may
+    take: their initial value and the values of all their set statements.
+    """
+    constants = _constant_values(program)
+    domains = {}
+    for name, value in program.ghosts.items():
+        value = _resolve(value, constants)
+        if isinstance(value, Literal):
+            domains[name] = {value.value}
+
+    for assignments in (*program.assignments.values(), *program.constructors):
+        for assignment in assignments:
+            if assignment.variable not in domains:
+                continue
+            value = _resolve(assignment.value, constants)
+            if isinstance(value, Literal):
+                domains[assignment.variable].add(value.value)
+            else:
+                del domains[assignment.variable]
+    return domains
+
+
+def _effect(assignments, constants, indices):
+    """
+    Return the set statements to state variables among `assignments` as a
+    list of (variable index, value, conditional) in source order.
+    """
+    return [(indices[a.variable], _resolve(a.value, constants).value,
+             a.conditional)
+            for a in assignments if a.variable in indices]
+
+
+def _effects(program, constants, indices):
+    """Return the effect (see `_effect`) of each method body."""
+    return {method: _effect(assignments, constants, indices)
+            for method, assignments in program.assignments.items()
+            if method is not None}
+
+
+def _apply(effect, state):
+    """Return the states a method body with set statements `effect` may
+    leave behind when started in `state`."""
+    states = {state}
+    for i, value, conditional in effect:
+        assigned = {s[:i] + (value,) + s[i + 1:] for s in states}
+        states = states | assigned if conditional else assigned
+    return states
+
+
+def initial_states(program, constants, indices, declared):
+    """
+    Return the states that construction may leave behind, starting from the
+    state `declared` of the declared initial values: the set statements
+    outside of methods run first, then those of any one constructor.
+    """
+    states = _apply(_effect(program.assignments.get(None, ()), constants,
+                            indices),
+                    declared)
+    if program.constructors:
+        effects = [_effect(assignments, constants, indices)
+                   for assignments in program.constructors]
+        states = {new
+                  for state in states
+                  for effect in effects
+                  for new in _apply(effect, state)}
+    return states
+
+
+def reachable_states(program, constants, indices, initial_state):
+    """
+    Return the states reachable from `initial_state` by any sequence of method
+    bodies, considering their set statements only.
+    """
+    return states_reachable(_effects(program, constants, indices).values(),
+                            initial_state)
+
+
+def states_reachable(effects, initial_state):
+    """
+    Return the states reachable from `initial_state` by any sequence of the
+    method bodies `effects`, each a list of set statements
+    (variable index, value, conditional).
+    """
+    effects = [e for e in effects if e]
+    result = {initial_state}
+    todo = [initial_state]
+    while todo:
+        state = todo.pop()
+        for effect in effects:
+            for new in _apply(effect, state):
+                if new not in result:
+                    result.add(new)
+                    todo.append(new)
+    return sorted(result)
+
+
+def _translate(expr, constants, ids):
+    """
+    Replace ghost constants in `expr` by their values and ghost variables by
+    `ids[i]`, where i is their position in `Program.ghosts`.
+    """
+    def aux(value):
+        match value:
+            case Variable(int(i)):
+                return Variable(ids[i])
+            case Old(int(i)):
+                return Old(ids[i])
+        return _resolve(value, constants)
+    return boolexpr.map_values(expr, aux)
+
+
+def _conjunction(clauses):
+    return boolexpr.chain(And, clauses)
+
+
+def contracts(program, constants, indices):
+    """
+    Return the methods of `program` whose contracts mention state variables
+    or are constant, mapped to their pre- and postcondition restricted to the
+    clauses that only mention state variables and to the constant clauses
+    that aren't always true, e.g. `requires false`. Clauses mentioning other
+    variables are counted as 'dropped_clauses' by `instrument`.
+    """
+    state_ids = set(indices.values())
+    # state variables become their index in the state tuple, other ghost
+    # variables their name, which isn't a state variable
+    ids = [indices.get(name, name) for name in program.ghosts]
+    methods = {}
+    for name, clauses in program.methods.items():
+        pres, posts = [], []
+        for clause in clauses:
+            expr = _translate(clause.expr, constants, ids)
+            for part in boolexpr.conjuncts(expr):
+                used = boolexpr.variables(part)
+                if not used <= state_ids:
+                    # e.g. method calls or fields outside the model
+                    instrument.count('dropped_clauses')
+                    continue
+                if not used:
+                    part = boolexpr.canonical(part)
+                    if part == BoolTrue():
+                        continue
+                match clause:
+                    case jml.Requires(_):
+                        pres.append(part)
+                    case jml.Ensures(_):
+                        posts.append(part)
+        if pres or posts:
+            methods[name] = (_conjunction(pres), _conjunction(posts))
+    return methods
+
+
+def from_program(program, joint=True):
+    """
+    Return the tuple (variables, possible_states, initial_state, methods) for
+    `program`, in the format of the examples in `cases.py`.
+
+    With `joint`, the possible states are those reachable by set statements
+    (see `reachable_states`), otherwise all combinations of the values of the
+    state variables.
+    """
+    constants = _constant_values(program)
+    domains = state_variables(program)
+    variables = tuple(domains)
+    indices = {name: i for i, name in enumerate(variables)}
+
+    declared = tuple(_resolve(program.ghosts[name], constants).value
+                     for name in variables)
+    initial = initial_states(program, constants, indices, declared)
+    if len(initial) != 1:
+        raise ValueError(
+                f'construction may leave the state variables {variables} in '
+                f'different states {sorted(initial)}, but the model has a '
+                f'single initial state')
+    [initial_state] = initial
+    if joint:
+        possible_states = reachable_states(program, constants, indices,
+                                           initial_state)
+    else:
+        possible_states = list(itertools.product(
+                *(sorted(domains[name]) for name in variables)))
+    methods = contracts(program, constants, indices)
+    return variables, possible_states, initial_state, methods
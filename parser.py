@@ -1,13 +1,19 @@
+import concurrent.futures
 import dataclasses
+import functools
 
-import tree_sitter_java
 import tree_sitter as ts
 
+import instrument
+import jml
 import query
+import sources
 import expression as expr
+from boolexpr import Rel, RelType, Variable, Old, Literal
+from sources import Program
 
 
-JAVA = ts.Language(tree_sitter_java.language())
+JAVA = query.JAVA
 
 @dataclasses.dataclass
 class Source:
@@ -15,79 +21,258 @@ class Source:
     code: str
 
 
-def _parse_source(source_file_path):
+def parse_bytes(code: bytes) -> Source:
+    """Parse the in-memory source `code`."""
+    with instrument.stage('parse'):
+        parser = ts.Parser(JAVA)
+        tree = parser.parse(code, encoding='utf8')
+    return Source(tree, code)
+
+
+def _point(code: bytes, byte):
+    """Return the (row, column) tree-sitter point of offset `byte` in `code`."""
+    row = code.count(b'\n', 0, byte)
+    return row, byte - (code.rfind(b'\n', 0, byte) + 1)
+
+
+def reparse(source: Source, start_byte, old_end_byte, new_text: bytes):
+    """
+    Replace `source.code[start_byte:old_end_byte]` with `new_text` and parse
+    the result incrementally, reusing the unchanged parts of `source.tree`.
+    `source.tree` is edited in place.
+    """
+    code = source.code[:start_byte] + new_text + source.code[old_end_byte:]
+    new_end_byte = start_byte + len(new_text)
+    source.tree.edit(
+            start_byte=start_byte,
+            old_end_byte=old_end_byte,
+            new_end_byte=new_end_byte,
+            start_point=_point(source.code, start_byte),
+            old_end_point=_point(source.code, old_end_byte),
+            new_end_point=_point(code, new_end_byte))
     parser = ts.Parser(JAVA)
+    tree = parser.parse(code, source.tree, encoding='utf8')
+    return Source(tree, code)
+
+
+def _parse_source(source_file_path):
     with open(source_file_path, 'rb') as file:
         code = file.read()
-        def read(byte_pos, _):
-            return code[byte_pos : byte_pos + 1]
-        tree = parser.parse(read, encoding='utf8')
-    return Source(tree, code)
+    return parse_bytes(code)
 
 
-def _node_to_str(node, code: Source):
-    return code[node.start_byte : node.end_byte]
+# statements whose bodies may be skipped or repeated
+_BRANCHING = frozenset((
+    'if_statement', 'switch_expression', 'switch_statement',
+    'while_statement', 'do_statement', 'for_statement',
+    'enhanced_for_statement', 'try_statement', 'catch_clause',
+    'lambda_expression', 'ternary_expression'))
 
 
-def _captured_strs(captures, code, key='the-name'):
-    for capture in captures[key]:
-        yield _node_to_str(capture, code)
+# statements that unlabeled `break` and `continue` jump out of or restart
+_JUMP_TARGETS = frozenset((
+    'switch_expression', 'switch_statement', 'while_statement',
+    'do_statement', 'for_statement', 'enhanced_for_statement'))
 
 
-@dataclasses.dataclass
-class Program:
-    normal: set[str]
-    ghost_constants: dict[str, int]
-    ghosts: dict[str, int]
+# declarations whose bodies set statements and abrupt exits belong to
+_BODIES = frozenset((
+    'method_declaration', 'constructor_declaration',
+    'compact_constructor_declaration'))
+
+
+def _enclosing_method(node):
+    """
+    Return the method or constructor declaration enclosing `node`, or None,
+    and whether `node` is inside a branch or loop of it.
+    """
+    conditional = False
+    while node is not None and node.type not in _BODIES:
+        conditional = conditional or node.type in _BRANCHING
+        node = node.parent
+    return node, conditional
+
+
+def _exit_scope(node):
+    """
+    Return the node whose statements after the abrupt exit `node` (return,
+    throw, break or continue) may be skipped: the loop or switch of an
+    unlabeled break or continue, the lambda of a return inside one, otherwise
+    the enclosing method or constructor, or None outside of them. Exceptions
+    are assumed not to be caught.
+    """
+    unlabeled = node.named_child_count == 0
+    scope = node.parent
+    while scope is not None and scope.type not in _BODIES:
+        match node.type:
+            case 'break_statement' | 'continue_statement' \
+                    if unlabeled and scope.type in _JUMP_TARGETS:
+                return scope
+            case 'return_statement' if scope.type == 'lambda_expression':
+                return scope
+        scope = scope.parent
+    return scope
+
+
+# a contract using \old(...) and what it has to be converted into
+_OLD_PROBE = b'//@ ensures \\old(x) == 0;\nvoid m() {}\n'
+_OLD_EXPECTED = Rel(RelType.EQUAL, Old('x'), Literal(0))
+
+
+@functools.cache
+def check_grammar():
+    r"""
+    Check that the installed grammar is the JML grammar that `expression`
+    expects: it has to have all of `expression.NODE_TYPES`, and \old(...) has
+    to be converted into `Old`. Raise RuntimeError otherwise, instead of
+    silently turning every \old(...) into an opaque variable and dropping the
+    clauses mentioning it.
+    """
+    missing = sorted(t for t in expr.NODE_TYPES
+                     if not JAVA.id_for_node_kind(t, True))
+    if missing:
+        raise RuntimeError(f'the grammar lacks the node types {missing}; '
+                           f'is the JML grammar installed (make parser)?')
+    source = parse_bytes(_OLD_PROBE)
+    for _, captures in query.PROGRAM.matches(source.tree.root_node):
+        match captures:
+            case {'postcondition': [node]}:
+                def to_str(n):
+                    return source.code[n.start_byte : n.end_byte].decode()
+                if expr.parse_condition(node, to_str) == _OLD_EXPECTED:
+                    return
+    raise RuntimeError(f'\\old(...) is not recognized in the syntax tree '
+                       f'{source.tree.root_node} of {_OLD_PROBE!r}')
+
 
 def program_from_tree(source: Source):
+    """
+    Extract a Program from the syntax tree of `source` in a single traversal
+    with the combined query `query.PROGRAM`.
+    """
+    check_grammar()
     root = source.tree.root_node
 
-    normal_captures = query.VARIABLES.captures(root)
-    normal = set(_captured_strs(normal_captures, source.code))
-    print(normal)
-
     def to_str(node):
         return source.code[node.start_byte : node.end_byte].decode('utf-8')
 
-    def aux(query):
-        captures = query.captures(root)
-        names = _captured_strs(captures, source.code, key='the-name')
-        values = map(lambda x: expr.parse_expression(x, to_str), captures['the-value'])
-        return dict(zip(names, values))
+    # subexpressions are shared within the file
+    interned = {}
+    # ghost variable name -> Variable(its position in program.ghosts),
+    # ghost constant name -> its value if that is an integer literal
+    symbols = {}
+
+    def parse_value(node):
+        return expr.parse_value(node, to_str, symbols, interned)
+
+    def parse_condition(node):
+        return expr.parse_condition(node, to_str, symbols, interned)
+
+    program = Program(set(), {}, {}, {}, {}, [])
+    # (method, name node, value, conditional) of each set statement
+    assignments = []
+    # (start byte, end byte) of the scope of each abrupt exit, and its end byte
+    exits = []
+    # start byte of each constructor -> its set statements
+    constructors = {}
+
+    with instrument.stage('extract'):
+        matches = [captures for _, captures in query.PROGRAM.matches(root)]
+        # the declarations first, so that the symbol table is complete before
+        # any expression referring to them is converted
+        for captures in matches:
+            match captures:
+                case {'ghost-name': [name]} if to_str(name) not in symbols:
+                    symbols[to_str(name)] = Variable(len(program.ghosts))
+                    program.ghosts[to_str(name)] = None
+                case {'constant-name': [name], 'constant-value': [value]}:
+                    value = parse_value(value)
+                    program.ghost_constants[to_str(name)] = value
+                    if isinstance(value, Literal):
+                        symbols[to_str(name)] = value
 
-    ghost_variables = aux(query.GHOST_VARIABLES)
-    ghost_constants = aux(query.GHOST_CONSTANTS)
+        for captures in matches:
+            match captures:
+                case {'variable-name': names}:
+                    program.normal.update(map(to_str, names))
+                case {'ghost-name': [name], 'ghost-value': [value]}:
+                    program.ghosts[to_str(name)] = parse_value(value)
+                case {'assignment-name': [name], 'assignment-value': [value]}:
+                    method, conditional = _enclosing_method(name)
+                    assignments.append(
+                            (method, name, parse_value(value), conditional))
+                case {'method-name': [name]}:
+                    clauses = ([(node, jml.Requires)
+                                for node in captures.get('precondition', [])]
+                               + [(node, jml.Ensures)
+                                  for node in captures.get('postcondition', [])])
+                    clauses.sort(key=lambda x: x[0].start_byte)
+                    program.methods[to_str(name)] = [
+                            clause(parse_condition(node))
+                            for node, clause in clauses]
+                case {'invariant': [node]}:
+                    program.invariants.append(jml.Invariant(parse_condition(node)))
+                case {'constructor': [node]}:
+                    constructors.setdefault(node.start_byte, [])
+                case {'exit': [node]}:
+                    scope = _exit_scope(node) or root
+                    exits.append((scope.start_byte, scope.end_byte,
+                                  node.end_byte))
 
-    print(ghost_variables)
-    print(ghost_constants)
+        # set statements after an exit in its scope might not be executed
+        for method, name, value, conditional in assignments:
+            start = name.start_byte
+            conditional = conditional or any(
+                    end <= start and scope_start <= start < scope_end
+                    for scope_start, scope_end, end in exits)
+            assignment = jml.Assignment(to_str(name), value, conditional)
+            if method is None:
+                program.assignments.setdefault(None, []).append(assignment)
+            elif method.type == 'method_declaration':
+                method = to_str(method.child_by_field_name('name'))
+                program.assignments.setdefault(method, []).append(assignment)
+            else:
+                # overloaded constructors share their name
+                constructors.setdefault(method.start_byte, []).append(
+                        assignment)
+        program.constructors = [constructors[start]
+                                for start in sorted(constructors)]
+
+    return program
 
 
 def parse(src_path):
-    parser = ts.Parser(JAVA)
-    with open(src_path, 'rb') as file:
-        source_code = file.read()
-        def read(byte_pos, _):
-            return source_code[byte_pos : byte_pos + 1]
-        tree = parser.parse(read, encoding='utf8')
+    """Parse the annotated source file at `src_path` and extract its Program."""
+    return program_from_tree(_parse_source(src_path))
 
-    #print(tree.root_node)
-    
-    source = Source(tree, source_code)
-    variables = program_from_tree(source)
 
-    import expression as e
+def _extract(code: bytes):
+    return program_from_tree(parse_bytes(code))
 
-    def to_str(node):
-        return source.code[node.start_byte : node.end_byte].decode('utf-8')
 
-    cursor = tree.walk()
-    cursor.goto_first_child()
-    while cursor.node.type != 'jml_invariant':
-        cursor.goto_next_sibling()
-    cursor.goto_first_child()
-    cursor.goto_next_sibling()
-    print(cursor.node.type)
+def _map(func, items, max_workers, chunksize):
+    """Yield `func(item)` for all `items` in order, across a process pool."""
+    if len(items) <= 1:
+        yield from map(func, items)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+        yield from pool.map(func, items, chunksize=chunksize)
+
+
+def parse_many(paths, max_workers=None, chunksize=8):
+    """
+    Parse and extract the Programs of all source files in `paths` (see
+    `sources.source_files`) across a pool of processes.
+
+    Yield pairs (path, Program) in the order of the files.
+    """
+    files = list(sources.source_files(paths))
+    yield from zip(files, _map(parse, files, max_workers, chunksize))
+
 
-    testo = e.parse_expression(cursor.node, to_str)
-    print(testo)
+def extract_many(codes, max_workers=None, chunksize=8):
+    """
+    Like `parse_many`, for the in-memory source codes `codes`. Yield their
+    Programs in order.
+    """
+    yield from _map(_extract, list(codes), max_workers, chunksize)
@@ -0,0 +1,146 @@
+"""
+Intersection of the state transition graph with a second automaton over
+method calls, the last step of `pipeline.txt`: restricting the temporal
+pretraces to call sequences the other automaton allows.
+
+The other automaton only needs a start state and a step function, so it can
+be infinite or expensive to build in full. Product states are explored on
+demand from the initial pair; only reachable pairs are ever constructed, and
+pairs whose state in the graph can't lead to a call of the requested methods
+are never explored. Pairs that are dead because of the other automaton are
+pruned before converting to a regex, so the conversion costs time in
+proportion to the useful part of the product.
+"""
+
+import functools
+
+import instrument
+import regex
+from dictutil import dict_entry_set_add
+
+
+class Automaton:
+    """
+    A (possibly lazy) automaton over method names describing the allowed call
+    sequences: a sequence is allowed while `step` keeps returning states.
+    `step(state, method)` returns the successor states of `state` when calling
+    `method`, an empty iterable if the call is not allowed. States must be
+    hashable.
+    """
+    def __init__(self, start, step):
+        self.start = start
+        self.step = functools.cache(step)
+
+
+def regex_automaton(r: regex.Regex) -> Automaton:
+    """
+    Return the automaton allowing all prefixes of the words of `r`, built
+    lazily by subset construction from the Thompson automaton of `r`.
+    """
+    nfa = regex.nfa(r)
+    def step(states, method):
+        successors = nfa.successors(states).get(method)
+        return (successors,) if successors else ()
+    return Automaton(nfa.start, step)
+
+
+def _coreachable(g, methods):
+    """Return the states of `g` from which one of `methods` can be called."""
+    flipped = {}
+    for pre, transitions in g.items():
+        for posts in transitions.values():
+            for post in posts:
+                dict_entry_set_add(flipped, post, pre)
+    result = {state for state, transitions in g.items()
+              if not transitions.keys().isdisjoint(methods)}
+    todo = list(result)
+    while todo:
+        for pre in flipped.get(todo.pop(), ()):
+            if pre not in result:
+                result.add(pre)
+                todo.append(pre)
+    return result
+
+
+def intersect(g, initial_state, automaton: Automaton, methods=None):
+    """
+    Return the product of the graph `g` with `automaton` restricted to the
+    pairs reachable from (`initial_state`, `automaton.start`), and that pair.
+
+    The product is a graph of the same form as `g` with (state, automaton
+    state) pairs as states: it has a transition labeled `method` wherever
+    both `g` and `automaton` have one. With `methods`, pairs whose state in
+    `g` can't lead to a call of one of them are left out; transitions labeled
+    with one of `methods` are kept, but not explored.
+    """
+    start = (initial_state, automaton.start)
+    live = None if methods is None else _coreachable(g, methods)
+    product = {}
+    todo = [start] if live is None or initial_state in live else []
+    seen = {start}
+    with instrument.stage('product'):
+        while todo:
+            pair = todo.pop()
+            state, q = pair
+            transitions = {}
+            for method, posts in g.get(state, {}).items():
+                if live is not None and method not in methods:
+                    posts = [post for post in posts if post in live]
+                    if not posts:
+                        continue
+                qs = automaton.step(q, method)
+                if not qs:
+                    continue
+                transitions[method] = [(post, q2) for post in posts for q2 in qs]
+                for post_pair in transitions[method]:
+                    if post_pair not in seen and (live is None
+                                                  or post_pair[0] in live):
+                        seen.add(post_pair)
+                        todo.append(post_pair)
+            if transitions:
+                product[pair] = transitions
+    instrument.count('product_states', len(seen))
+    return product, start
+
+
+def prune(product, method):
+    """
+    Return the part of `product` from which a state where `method` can be
+    called is reachable; all other (dead) states are removed.
+    """
+    live = _coreachable(product, (method,))
+    result = {}
+    for pair in live:
+        transitions = {}
+        for name, posts in product[pair].items():
+            posts = [post for post in posts if post in live or name == method]
+            if posts:
+                transitions[name] = posts
+        result[pair] = transitions
+    return result
+
+
+def pretrace(g, initial_state, automaton: Automaton, method,
+             **options) -> regex.Regex | None:
+    """
+    Return the regex of all call sequences from `initial_state` that
+    `automaton` allows and after which `method` may be called, or None if
+    there are none. `options` are passed on to `regex.from_graph`.
+    """
+    product, start = intersect(g, initial_state, automaton, (method,))
+    pruned = prune(product, method)
+    if start not in pruned:
+        return None
+    return regex.from_graph(pruned, start, method, **options)
+
+
+def pretraces(g, initial_state, automaton: Automaton, methods,
+              **options) -> dict[str, regex.Regex | None]:
+    """Like `pretrace`, for all `methods`, sharing the product."""
+    product, start = intersect(g, initial_state, automaton, methods)
+    result = {}
+    for method in methods:
+        pruned = prune(product, method)
+        result[method] = (regex.from_graph(pruned, start, method, **options)
+                          if start in pruned else None)
+    return result
@@ -1,50 +1,49 @@
-import tree_sitter_java
-from tree_sitter import Language, Parser
+"""
+Tree-sitter queries for extracting programs from annotated Java sources.
 
-JAVA = Language(tree_sitter_java.language())
+Each query in `_SOURCES` is available as a module attribute of the same name,
+e.g. `query.PROGRAM`, and the tree-sitter Java language as `query.JAVA`. They
+are compiled on first access, and tree-sitter is only imported then, so
+importing this module is cheap.
+"""
+
+import functools
+
+_SOURCES = {}
 
 # includes constants (i.e. 'final')
-VARIABLES = JAVA.query(
-        """
+_SOURCES['VARIABLES'] = """
 (local_variable_declaration
   declarator: (variable_declarator
     name: (identifier) @the-name
     )
 )
         """
-)
 
-GHOST_VARIABLES = JAVA.query(
-        """
+_SOURCES['GHOST_VARIABLES'] = """
 (jml_ghost_declaration
   !final
   (variable_declarator
     name: (identifier) @the-name
     value: (_) @the-value))
         """
-)
 
-GHOST_CONSTANTS = JAVA.query(
-        """
+_SOURCES['GHOST_CONSTANTS'] = """
 (jml_ghost_declaration
   "final"
   (variable_declarator
     name: (identifier) @the-name
     value: (_) @the-value))
         """
-)
 
-GHOST_ASSIGNMENTS = JAVA.query(
-        """
+_SOURCES['GHOST_ASSIGNMENTS'] = """
 (jml_set_statement
   (variable_declarator
     name: (identifier) @the-name
     value: (_) @the-value))
         """
-)
 
-METHODS = JAVA.query(
-        """
+_SOURCES['METHODS'] = """
 (method_declaration
   (jml_contract
     [
@@ -53,10 +52,73 @@ METHODS = JAVA.query(
     ])+
   name: (identifier) @method-name)
         """
-)
 
-INVARIANTS = JAVA.query(
-        """
+_SOURCES['INVARIANTS'] = """
 (jml_invariant (_) @invariant)
         """
+
+# All of the above in one query, so a single traversal of the tree collects
+# everything. Matches are told apart by their capture names.
+_SOURCES['PROGRAM'] = """
+(local_variable_declaration
+  declarator: (variable_declarator
+    name: (identifier) @variable-name
+    )
 )
+
+(jml_ghost_declaration
+  !final
+  (variable_declarator
+    name: (identifier) @ghost-name
+    value: (_) @ghost-value))
+
+(jml_ghost_declaration
+  "final"
+  (variable_declarator
+    name: (identifier) @constant-name
+    value: (_) @constant-value))
+
+(jml_set_statement
+  (variable_declarator
+    name: (identifier) @assignment-name
+    value: (_) @assignment-value))
+
+(method_declaration
+  (jml_contract
+    [
+      (jml_requires (_) @precondition)
+      (jml_ensures (_) @postcondition)
+    ])+
+  name: (identifier) @method-name)
+
+(jml_invariant (_) @invariant)
+
+(constructor_declaration) @constructor
+
+[
+  (return_statement)
+  (throw_statement)
+  (break_statement)
+  (continue_statement)
+] @exit
+        """
+
+
+@functools.cache
+def _language():
+    import tree_sitter_java
+    from tree_sitter import Language
+    return Language(tree_sitter_java.language())
+
+
+@functools.cache
+def _compile(name):
+    return _language().query(_SOURCES[name])
+
+
+def __getattr__(name):
+    if name == 'JAVA':
+        return _language()
+    if name in _SOURCES:
+        return _compile(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
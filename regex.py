@@ -13,8 +13,14 @@ import functools
 from typing import Self
 
 from dictutil import dict_entry_set_add
+import instrument
 
 class Regex:
+    # Regexes share subtrees, so computing their hashes from scratch every
+    # time would walk the shared subtrees again and again. Each node keeps
+    # its hash once computed (see `_cache_hash`).
+    __slots__ = ('_hash',)
+
     def __str__(self):
         match self:
             case Empty():
@@ -43,9 +49,24 @@ class Regex:
                 result = f'({expr})?'
         return result
 
-dataclass = functools.partial(
-        dataclasses.dataclass,
-        slots=True, frozen=True)
+def _cache_hash(cls):
+    """Make the dataclass `cls` compute the hash of an instance only once."""
+    compute = cls.__hash__
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            result = compute(self)
+            object.__setattr__(self, '_hash', result)
+            return result
+    cls.__hash__ = __hash__
+    return cls
+
+
+def dataclass(cls):
+    """The dataclass decorator of the `Regex` subclasses, see `_cache_hash`."""
+    return _cache_hash(dataclasses.dataclass(cls, slots=True, frozen=True))
 
 @dataclass
 class Empty(Regex):
@@ -200,6 +221,12 @@ def alter_to_list(regex):
     return [regex]
 
 
+def list_to_alter(alternatives):
+    """Inverse of `alter_to_list`. `alternatives` must not be empty."""
+    return functools.reduce(lambda acc, x: alter(x, acc),
+                            reversed(alternatives[:-1]), alternatives[-1])
+
+
 def pass_on(func, regex: Regex) -> Regex:
     """
     Helper function that applies `func` recursively to all class members of
@@ -266,6 +293,100 @@ def collapse_same_prefix(regex: Regex) -> Regex:
     return pass_on(collapse_same_prefix, regex)
 
 
+class _Trie:
+    """Trie of sequences of regexes; `end` marks where a sequence ends."""
+    __slots__ = ('children', 'end')
+
+    def __init__(self):
+        self.children = {}
+        self.end = False
+
+    def add(self, sequence):
+        node = self
+        for item in sequence:
+            node = node.children.setdefault(item, _Trie())
+        node.end = True
+
+
+def _sequence(regex):
+    return [] if regex == Empty() else concat_to_list(regex)
+
+
+def _alternation(alternatives, end):
+    """Return the alternation of `alternatives`, optional if `end`."""
+    if not alternatives:
+        return empty()
+    result = list_to_alter(alternatives)
+    return optional(result) if end else result
+
+
+def _from_suffixes(node):
+    """Rebuild an alternation from a trie of reversed sequences."""
+    branches = [concat(_from_suffixes(child), item)
+                for item, child in node.children.items()]
+    return _alternation(branches, node.end)
+
+
+def _factor_suffixes(alternatives):
+    """
+    Return the alternation of `alternatives` with common suffixes factored
+    out, e.g. b c | d c -> (b | d) c.
+    """
+    trie = _Trie()
+    for x in alternatives:
+        trie.add(reversed(_sequence(x)))
+    return _from_suffixes(trie)
+
+
+def _from_prefixes(node):
+    """Rebuild an alternation from a trie of sequences."""
+    branches = [concat(item, _from_prefixes(child))
+                for item, child in node.children.items()]
+    if len(branches) > 1:
+        branches = alter_to_list(_factor_suffixes(branches))
+    return _alternation(branches, node.end)
+
+
+def factor_alternations(regex: Regex) -> Regex:
+    """
+    Factor out common prefixes and suffixes of the alternatives of every
+    alternation, e.g.
+      a b c | a d c -> a (b | d) c
+      a | a b       -> a b?
+    Each alternation is turned into a trie of its alternatives' prefixes; at
+    every branch of the trie, the branches are put into a trie of suffixes.
+    The alternation is rebuilt from these tries.
+    """
+    match regex:
+        case Alter(_, _):
+            trie = _Trie()
+            for x in alter_to_list(regex):
+                trie.add(_sequence(factor_alternations(x)))
+            return _from_prefixes(trie)
+
+    return pass_on(factor_alternations, regex)
+
+
+def prune_subsumed(regex: Regex) -> Regex:
+    """
+    Drop alternatives whose language is included in that of another
+    alternative of the same alternation, e.g.
+      a a* | a+ -> a a*
+      ε | a* -> a*
+    """
+    match regex:
+        case Alter(_, _):
+            kept = []
+            for x in map(prune_subsumed, alter_to_list(regex)):
+                if any(includes(x, k) for k in kept):
+                    continue
+                kept = [k for k in kept if not includes(k, x)]
+                kept.append(x)
+            return list_to_alter(kept)
+
+    return pass_on(prune_subsumed, regex)
+
+
 def must_contain(regex: Regex) -> Regex:
     regex = eliminate_optionals(regex)
     regex = collapse_same_prefix(regex)
@@ -293,6 +414,150 @@ def last_calls(regex: Regex) -> Regex:
     return set(alter_to_list(aux(regex)))
 
 
+# Language comparison #
+# Decided on the fly on the subset construction of Thompson automata, which
+# are linear in the size of the regex. DFA states are sets of integers, so
+# they are cheap to hash and compare. Results are kept in LRU caches of
+# CACHE_SIZE entries, so that long-running processes don't keep those of
+# every regex they have seen.
+
+CACHE_SIZE = 2**12
+
+_memoized = functools.lru_cache(maxsize=CACHE_SIZE)
+
+@_memoized
+def nullable(regex: Regex) -> bool:
+    """Return True if `regex` matches the empty word."""
+    match regex:
+        case Empty() | Repeat(_) | Optional(_):
+            return True
+        case Terminal(_):
+            return False
+        case RepeatOne(a):
+            return nullable(a)
+        case Alter(l, r):
+            return nullable(l) or nullable(r)
+        case Concat(l, r):
+            return nullable(l) and nullable(r)
+
+
+@_memoized
+def terminals(regex: Regex) -> frozenset:
+    """Return the names of all terminals in `regex`."""
+    match regex:
+        case Empty():
+            return frozenset()
+        case Terminal(name):
+            return frozenset((name,))
+        case Repeat(a) | RepeatOne(a) | Optional(a):
+            return terminals(a)
+        case Alter(l, r) | Concat(l, r):
+            return terminals(l) | terminals(r)
+
+
+class Nfa:
+    """
+    Thompson automaton of a regex. `start` is the epsilon closure of the
+    start state and `final` the only accepting state; sets of states are
+    stepped with `successors` and checked with `accepts`.
+    """
+    def __init__(self, regex):
+        self.epsilon = []
+        self.moves = []
+        start = self._state()
+        self.final = self._state()
+        self._build(regex, start, self.final)
+        self.start = self.closure((start,))
+
+    def _state(self):
+        self.epsilon.append([])
+        self.moves.append([])
+        return len(self.moves) - 1
+
+    def _build(self, regex, src, dst):
+        """Add transitions from `src` to `dst` that read the words of `regex`."""
+        match regex:
+            case Empty():
+                self.epsilon[src].append(dst)
+            case Terminal(name):
+                self.moves[src].append((name, dst))
+            case Optional(a):
+                self.epsilon[src].append(dst)
+                self._build(a, src, dst)
+            case Repeat(a):
+                loop = self._state()
+                self.epsilon[src].append(loop)
+                self.epsilon[loop].append(dst)
+                self._build(a, loop, loop)
+            case RepeatOne(a):
+                first, last = self._state(), self._state()
+                self.epsilon[src].append(first)
+                self._build(a, first, last)
+                self.epsilon[last].extend((first, dst))
+            case Alter(a, b):
+                self._build(a, src, dst)
+                self._build(b, src, dst)
+            case Concat(a, b):
+                mid = self._state()
+                self._build(a, src, mid)
+                self._build(b, mid, dst)
+
+    def closure(self, states) -> frozenset:
+        result = set(states)
+        todo = list(result)
+        while todo:
+            for s in self.epsilon[todo.pop()]:
+                if s not in result:
+                    result.add(s)
+                    todo.append(s)
+        return frozenset(result)
+
+    def successors(self, states) -> dict:
+        """Return the states reached from `states` by each terminal."""
+        result = {}
+        for s in states:
+            for symbol, d in self.moves[s]:
+                result.setdefault(symbol, set()).add(d)
+        return {symbol: self.closure(ds) for symbol, ds in result.items()}
+
+    def accepts(self, states) -> bool:
+        return self.final in states
+
+
+@_memoized
+def nfa(regex) -> Nfa:
+    """
+    Return the Thompson automaton of `regex`, e.g. for running words of
+    method names through it. Equal regexes share their automaton.
+    """
+    return Nfa(regex)
+
+
+@_memoized
+def includes(sub: Regex, sup: Regex) -> bool:
+    """Return True if the language of `sub` is a subset of that of `sup`."""
+    left_nfa, right_nfa = nfa(sub), nfa(sup)
+    start = (left_nfa.start, right_nfa.start)
+    seen = {start}
+    todo = [start]
+    while todo:
+        left, right = todo.pop()
+        if left_nfa.accepts(left) and not right_nfa.accepts(right):
+            return False
+        right_successors = right_nfa.successors(right)
+        for symbol, left_d in left_nfa.successors(left).items():
+            pair = (left_d, right_successors.get(symbol, frozenset()))
+            if pair not in seen:
+                seen.add(pair)
+                todo.append(pair)
+    return True
+
+
+def equivalent(l: Regex, r: Regex) -> bool:
+    """Return True if `l` and `r` describe the same language."""
+    return l == r or (includes(l, r) and includes(r, l))
+
+
 def to_regex_graph(graph, starting_node=None, ending_nodes=None):
     """
     Convert a graph with transitions state--method->state into transitions
@@ -350,7 +615,52 @@ def _flipped(graph):
     return result
 
 
-def _ripout(graph, flipped, node):
+@dataclasses.dataclass(frozen=True, slots=True)
+class Approximation:
+    """Record of an edge label that was replaced for exceeding the budget."""
+    source: ...
+    destination: ...
+    size: int
+    regex: Regex
+
+
+def over_approximation(regex: Regex) -> Regex:
+    """
+    Return `(a|b|...)*` over all terminals of `regex`, whose language includes
+    that of `regex`.
+    """
+    names = sorted(terminals(regex), key=str)
+    if not names:
+        return empty()
+    return repeat(list_to_alter(list(map(terminal, names))))
+
+
+class _Budget:
+    """
+    Upper bounds of the node counts of all edge labels during state
+    elimination, updated incrementally from the bounds of the composed labels.
+    Labels exceeding `limit` are replaced with their over-approximation.
+    """
+    def __init__(self, graph, limit, approximated=None):
+        self.limit = limit
+        self.approximated = approximated
+        self.sizes = {(s, d): size(r)
+                      for s, ts in graph.items()
+                      for d, r in ts.items()}
+
+    def fit(self, graph, src, dst, regex, estimate):
+        if estimate > self.limit:
+            approximation = over_approximation(regex)
+            instrument.count('approximations')
+            if self.approximated is not None:
+                self.approximated.append(
+                        Approximation(src, dst, estimate, approximation))
+            regex, estimate = approximation, size(approximation)
+        graph[src][dst] = regex
+        self.sizes[src, dst] = estimate
+
+
+def _ripout(graph, flipped, node, budget=None):
     """
     One step in the state elimination method. Eliminates one state by composing
     all transitions into and out of the state.
@@ -368,14 +678,25 @@ def _ripout(graph, flipped, node):
     # this updates flipped with the transitions created in the below loop
     flipped_additions = {}
 
+    if budget is not None:
+        size_self = budget.sizes.pop((node, node), -1) + 1
+
     for n_in in flipped[node]:
         r_in = graph[n_in][node]
         for n_out, r_out in graph[node].items():
             r_new = concat(r_in, concat(r_self, r_out))
+            if budget is not None:
+                estimate = (budget.sizes[n_in, node] + size_self
+                            + budget.sizes[node, n_out] + 2)
             if n_out in graph[n_in]:
                 r_already = graph[n_in][n_out]
                 r_new = alter(r_already, r_new)
-            graph[n_in][n_out] = r_new
+                if budget is not None:
+                    estimate += budget.sizes[n_in, n_out] + 1
+            if budget is None:
+                graph[n_in][n_out] = r_new
+            else:
+                budget.fit(graph, n_in, n_out, r_new, estimate)
 
             dict_entry_set_add(flipped_additions, n_out, n_in)
 
@@ -389,21 +710,344 @@ def _ripout(graph, flipped, node):
         if node in ts:
             ts.remove(node)
 
+    if budget is not None:
+        for n in flipped[node]:
+            del budget.sizes[n, node]
+        for n in graph[node]:
+            del budget.sizes[node, n]
+
     del graph[node]
     del flipped[node]
 
 
-def from_graph(source, starting_state, method):
+def _from_graph_elimination(source, starting_state, method,
+                            budget=None, approximated=None):
     """
     Convert a NFA into a regular expression with the state elimination method.
+
+    If `budget` is given, intermediate edge labels with more than `budget`
+    nodes are replaced by their over-approximation, and an `Approximation`
+    is appended to the list `approximated` for each replacement.
     """
     ending_nodes = [k for k, v in source.items() if method in v]
     regex_graph = to_regex_graph(source, starting_state, ending_nodes)
     flipped = _flipped(regex_graph)
     all_nodes = source.keys()
+    if budget is not None:
+        budget = _Budget(regex_graph, budget, approximated)
 
     # TODO investigate why `reversed(all_nodes)` results in much longer regexes
-    for node in all_nodes:
-        _ripout(regex_graph, flipped, node)
+    with instrument.stage('elimination'):
+        for node in all_nodes:
+            _ripout(regex_graph, flipped, node, budget)
+    instrument.count('eliminated_nodes', len(all_nodes))
 
     return regex_graph['S']['E']
+
+
+def _alter_similar(l, r):
+    """
+    Alternation modulo similarity, i.e. associativity, commutativity and
+    idempotence of `|`: alternatives of `r` already present in `l` are dropped.
+    `None` stands for the empty language.
+    """
+    if l is None:
+        return r
+    if r is None:
+        return l
+    alternatives = dict.fromkeys(alter_to_list(l) + alter_to_list(r))
+    return list_to_alter(list(alternatives))
+
+
+def _equations(source, method):
+    """
+    Return the system of language equations of the NFA `source`: for every
+    state q, the language X_q of words leading from q into a state where
+    `method` may be called is
+      X_q = a_1 X_r1 | ... | a_n X_rn | c_q
+    where q--a_i->r_i are the transitions of q, and c_q is ε if `method` may be
+    called in q or the empty language otherwise.
+
+    Each equation is a pair (coefficients, constant) where coefficients maps
+    r_i to the (similarity-normalized) alternation of all a_i leading to r_i.
+    The empty language is represented by `None`.
+    """
+    equations = {}
+    for s, ts in source.items():
+        coefficients = {}
+        for t, ds in ts.items():
+            for d in ds:
+                coefficients[d] = _alter_similar(coefficients.get(d),
+                                                 terminal(t))
+        constant = empty() if method in ts else None
+        equations[s] = (coefficients, constant)
+    return equations
+
+
+def _concat_or_none(l, r):
+    """Concatenation where `None` is the empty language."""
+    if l is None or r is None:
+        return None
+    return concat(l, r)
+
+
+def _arden(coefficients, constant, var):
+    """
+    Apply Arden's lemma to the equation X = A X | B, where A is the coefficient
+    of `var` itself: X = A* B. Removes `var` from `coefficients`.
+    """
+    if var not in coefficients:
+        return coefficients, constant
+    loop = repeat(coefficients.pop(var))
+    coefficients = {r: concat(loop, c) for r, c in coefficients.items()}
+    return coefficients, _concat_or_none(loop, constant)
+
+
+def _from_graph_equations(source, starting_state, method):
+    """
+    Convert a NFA into a regular expression by solving its system of language
+    equations (Brzozowski's algebraic method).
+
+    Every state except `starting_state` is solved for with Arden's lemma and
+    substituted into the equations that refer to it, those with the fewest
+    paths through them first. The equation left for `starting_state` then has
+    no other variables and gives the result.
+
+    The equations are read off the transitions of `source`: the derivative
+    of X_q by a terminal a is the alternation of the X_r with q--a->r.
+    Computing derivatives of regexes, memoized or not, would only rebuild
+    what the graph already gives, so none are computed.
+    """
+    with instrument.stage('equations'):
+        return _solve_equations(source, starting_state, method)
+
+
+def _solve_equations(source, starting_state, method):
+    equations = _equations(source, method)
+
+    referrers = {}
+    for s, (coefficients, _) in equations.items():
+        for d in coefficients:
+            dict_entry_set_add(referrers, d, s)
+
+    # eliminating states with few paths through them first keeps the
+    # intermediate regexes small
+    def paths_through(q):
+        return len(referrers.get(q, ())) * len(equations[q][0])
+    for node in sorted(source, key=paths_through):
+        if node == starting_state:
+            continue
+        coefficients, constant = _arden(*equations.pop(node), node)
+
+        for n_in in referrers.pop(node, ()):
+            if n_in not in equations:
+                continue
+            in_coefficients, in_constant = equations[n_in]
+            a = in_coefficients.pop(node)
+            for n_out, c in coefficients.items():
+                in_coefficients[n_out] = _alter_similar(
+                        in_coefficients.get(n_out), concat(a, c))
+                dict_entry_set_add(referrers, n_out, n_in)
+            in_constant = _alter_similar(in_constant,
+                                         _concat_or_none(a, constant))
+            equations[n_in] = (in_coefficients, in_constant)
+        instrument.count('eliminated_nodes')
+
+    _, result = _arden(*equations[starting_state], starting_state)
+    if result is None:
+        raise KeyError(method)
+    return result
+
+
+def _sccs(source, start):
+    """
+    Return the strongly connected components of `source` reachable from
+    `start` in topological order (Tarjan's algorithm, iteratively).
+    """
+    def successors(s):
+        return iter(dict.fromkeys(d for ds in source.get(s, {}).values()
+                                  for d in ds))
+    index, low = {start: 0}, {start: 0}
+    stack, on_stack = [start], {start}
+    work = [(start, successors(start))]
+    result = []
+    while work:
+        node, it = work[-1]
+        for succ in it:
+            if succ not in index:
+                index[succ] = low[succ] = len(index)
+                stack.append(succ)
+                on_stack.add(succ)
+                work.append((succ, successors(succ)))
+                break
+            if succ in on_stack:
+                low[node] = min(low[node], index[succ])
+        else:
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while (s := stack.pop()) != node:
+                    on_stack.remove(s)
+                    component.append(s)
+                on_stack.remove(node)
+                component.append(node)
+                result.append(component)
+    result.reverse()
+    return result
+
+
+_TARGET = object()
+
+
+class Summary:
+    """
+    Paths from `starting_state` through `source`, organized by the strongly
+    connected components (SCCs) of `source`.
+
+    The paths within an SCC are summarized by state elimination on the SCC
+    alone, from each of its entry states to each set of target states. The
+    paths into an SCC are composed from the summaries of the SCCs before it
+    in the DAG of SCCs. Summaries are cached, so that one `Summary` serves the
+    pretraces of all methods.
+    """
+    def __init__(self, source, starting_state):
+        self.source = source
+        self._within = {}
+        with instrument.stage('scc'):
+            # states in the order of `source`, to break ties in the
+            # elimination order
+            order = {q: n for n, q in enumerate(source)}
+            self.components = [sorted(c, key=lambda q: order.get(q, len(order)))
+                               for c in _sccs(source, starting_state)]
+            self.component = {q: i for i, component in enumerate(self.components)
+                              for q in component}
+            # entry states of each SCC mapped to the paths leading into them
+            self.entering = [{} for _ in self.components]
+            self.entering[0][starting_state] = empty()
+            for i, component in enumerate(self.components):
+                self._propagate(i, component)
+        instrument.count('sccs', len(self.components))
+
+    def within(self, i, entry, targets: frozenset):
+        """
+        Return the paths from `entry` to any of `targets` within the `i`th
+        SCC.
+        """
+        key = (entry, targets)
+        if key not in self._within:
+            members = set(self.components[i])
+            sub, degree = {}, dict.fromkeys(members, 0)
+            for q in self.components[i]:
+                transitions = {t: [d for d in ds if d in members]
+                               for t, ds in self.source.get(q, {}).items()}
+                for ds in transitions.values():
+                    for d in ds:
+                        degree[d] += 1
+                if q in targets:
+                    transitions[_TARGET] = []
+                sub[q] = transitions
+            # eliminating states with few paths through them first keeps the
+            # intermediate regexes small
+            for q, transitions in sub.items():
+                degree[q] *= sum(map(len, transitions.values()))
+            sub = {q: sub[q] for q in sorted(sub, key=degree.get)}
+            self._within[key] = _from_graph_elimination(sub, entry, _TARGET)
+        return self._within[key]
+
+    def _into(self, i, targets: frozenset):
+        """Return the paths from the starting state to any of `targets`, all
+        in the `i`th SCC, or None if there are none."""
+        result = None
+        for entry, prefix in self.entering[i].items():
+            result = _alter_similar(
+                    result, concat(prefix, self.within(i, entry, targets)))
+        return result
+
+    def _propagate(self, i, component):
+        """Add the paths leaving the `i`th SCC to the entering paths of the
+        SCCs they lead into."""
+        for q in component:
+            prefix = None
+            for t, ds in self.source.get(q, {}).items():
+                for d in ds:
+                    j = self.component[d]
+                    if j == i:
+                        continue
+                    if prefix is None:
+                        prefix = self._into(i, frozenset((q,)))
+                    self.entering[j][d] = _alter_similar(
+                            self.entering[j].get(d), concat(prefix, terminal(t)))
+
+    def pretrace(self, method):
+        """
+        Return the regex of all paths into states where `method` may be called.
+        Raises KeyError if there are none.
+        """
+        result = None
+        for i, component in enumerate(self.components):
+            targets = frozenset(q for q in component
+                                if method in self.source.get(q, {}))
+            if targets:
+                result = _alter_similar(result, self._into(i, targets))
+        if result is None:
+            raise KeyError(method)
+        return result
+
+
+def _from_graph_scc(source, starting_state, method, summary=None):
+    """
+    Convert a NFA into a regular expression from its SCC `Summary`, which is
+    computed if not given.
+    """
+    if summary is None:
+        summary = Summary(source, starting_state)
+    return summary.pretrace(method)
+
+
+ENGINES = {
+    'elimination': _from_graph_elimination,
+    'equations': _from_graph_equations,
+    'scc': _from_graph_scc,
+}
+
+
+def from_graph(source, starting_state, method, engine='elimination',
+               **options):
+    """
+    Convert a NFA into a regular expression describing all call sequences from
+    `starting_state` after which `method` may be called.
+
+    `engine` selects the conversion algorithm from `ENGINES`:
+      'elimination'  state elimination on the graph,
+      'equations'    solving the language equations with Arden's lemma,
+      'scc'          composing summaries of strongly connected components.
+    All give the same language but may differ in size and running time.
+
+    `options` are passed on to the engine, e.g. `budget` and `approximated`
+    for 'elimination' or a shared `summary` for 'scc'.
+    """
+    return ENGINES[engine](source, starting_state, method, **options)
+
+
+def shared_options(source, starting_state, options):
+    """
+    Return `options` for `from_graph` extended with the data that its engine
+    can share between all methods of `source`.
+    """
+    if options.get('engine') == 'scc' and 'summary' not in options:
+        return options | {'summary': Summary(source, starting_state)}
+    return options
+
+
+def size(regex: Regex) -> int:
+    """Return the number of nodes of `regex`."""
+    match regex:
+        case Empty() | Terminal(_):
+            return 1
+        case Repeat(a) | RepeatOne(a) | Optional(a):
+            return 1 + size(a)
+        case Alter(l, r) | Concat(l, r):
+            return 1 + size(l) + size(r)
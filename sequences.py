@@ -0,0 +1,148 @@
+"""
+Counting, enumeration and uniform sampling of the call sequences after which
+a method may be called, e.g. for test generation.
+
+Call sequences are words over method names, so sequences are counted on the
+subset construction of the graph of `graph.from_program`: a method may lead
+from one state into several, and each word must be counted once. Subsets are
+built lazily, only those reachable within the requested length.
+
+For a method m and a maximum length k, the number of completions of length r
+from each subset S is computed by dynamic programming:
+  N_0(S) = 1 if m may be called in a state of S, else 0
+  N_r(S) = sum of N_{r-1}(S') over the successors S' of S
+Enumeration and sampling are guided by these numbers, so they never visit
+prefixes without completions, and no set of sequences is ever materialized.
+"""
+
+import random
+
+# tables kept per Sequences, least recently used ones are dropped first
+MAX_TABLES = 16
+
+
+class Sequences:
+    """Call sequences of the graph `g` from `initial_state`."""
+    def __init__(self, g, initial_state):
+        self.graph = g
+        self.start = frozenset((initial_state,))
+        self._successors = {}
+        self._tables = {}
+
+    def successors(self, subset) -> dict:
+        """Return the subsets reached from `subset` by each method."""
+        result = self._successors.get(subset)
+        if result is None:
+            posts = {}
+            for state in subset:
+                for method, ds in self.graph.get(state, {}).items():
+                    posts.setdefault(method, set()).update(ds)
+            result = {method: frozenset(ds)
+                      for method, ds in sorted(posts.items())}
+            self._successors[subset] = result
+        return result
+
+    def _within(self, k):
+        """Return the subsets reachable in at most `k` steps."""
+        result = {self.start}
+        frontier = [self.start]
+        for _ in range(k):
+            new = []
+            for subset in frontier:
+                for successor in self.successors(subset).values():
+                    if successor not in result:
+                        result.add(successor)
+                        new.append(successor)
+            frontier = new
+        return result
+
+    def _table(self, method, k):
+        """
+        Return the list of N_0, ..., N_k for `method`, each a dict of the
+        subsets reachable within k steps to their number of completions.
+        """
+        key = (method, k)
+        if key in self._tables:
+            # move to the end: dicts keep insertion order
+            self._tables[key] = self._tables.pop(key)
+        else:
+            subsets = self._within(k)
+            table = [{s: int(any(method in self.graph.get(state, {})
+                                 for state in s))
+                      for s in subsets}]
+            for _ in range(k):
+                previous = table[-1]
+                table.append({s: sum(previous.get(d, 0)
+                                     for d in self.successors(s).values())
+                              for s in subsets})
+            if len(self._tables) >= MAX_TABLES:
+                del self._tables[next(iter(self._tables))]
+            self._tables[key] = table
+        return self._tables[key]
+
+    def counts(self, method, k) -> list[int]:
+        """
+        Return the numbers of call sequences of length 0, ..., `k` after
+        which `method` may be called.
+        """
+        table = self._table(method, k)
+        return [table[n][self.start] for n in range(k + 1)]
+
+    def count(self, method, k) -> int:
+        """Return the number of such call sequences of length at most `k`."""
+        return sum(self.counts(method, k))
+
+    def sequences(self, method, k):
+        """
+        Yield all call sequences of length at most `k` after which `method`
+        may be called, shortest first, then in alphabetical order.
+        """
+        table = self._table(method, k)
+        for n in range(k + 1):
+            if table[n][self.start] == 0:
+                continue
+            stack = [(self.start, n, ())]
+            while stack:
+                subset, remaining, prefix = stack.pop()
+                if remaining == 0:
+                    yield prefix
+                    continue
+                for name, successor in reversed(
+                        self.successors(subset).items()):
+                    if table[remaining - 1][successor]:
+                        stack.append((successor, remaining - 1,
+                                      prefix + (name,)))
+
+    def sample(self, method, k, rng=random) -> tuple | None:
+        """
+        Return a call sequence drawn uniformly from all those of length at
+        most `k` after which `method` may be called, or None if there are
+        none.
+        """
+        table = self._table(method, k)
+        counts = [table[n][self.start] for n in range(k + 1)]
+        total = sum(counts)
+        if not total:
+            return None
+        # counts grow exponentially with k, too large for float weights
+        n = _pick(range(k + 1), counts, rng.randrange(total))
+        subset, result = self.start, []
+        for remaining in range(n, 0, -1):
+            choices = self.successors(subset).items()
+            weights = [table[remaining - 1][s] for _, s in choices]
+            name, subset = _pick(choices, weights,
+                                 rng.randrange(table[remaining][subset]))
+            result.append(name)
+        return tuple(result)
+
+
+def _pick(choices, weights, index):
+    """
+    Return the choice that the integer `index` falls on when the choices
+    take up consecutive ranges of the sizes `weights`.
+    """
+    for choice, weight in zip(choices, weights):
+        if index < weight:
+            return choice
+        index -= weight
+    raise ValueError('index out of range')
@@ -0,0 +1,340 @@
+"""
+Long-running analysis server that keeps the parsed trees and analyses of
+source files in memory between requests.
+
+Speaks JSON-RPC 2.0 with one message per line, either over stdin/stdout or
+over a local (unix domain) socket. Methods, all with a `path` parameter
+naming a source file:
+  open          (re)load a file, optionally with its unsaved `text`
+  edit          replace `text` between `start_byte` and `old_end_byte`
+  methods       names of all analysed methods
+  pretrace      regex pretrace of `method`, raw and simplified, and whether
+                it was over-approximated
+  must_contain  must-contain set of `method`
+  last_calls    calls the pretraces of `method` end with
+  naive_cat     naive CAT pretrace of `method`
+and `shutdown` without parameters.
+
+Requests are handled concurrently. Analysis is pure Python and CPU-bound, so
+it runs in worker processes: every file is assigned to one worker, which keeps
+its session, and requests for the same file are serialized. Requests for files
+of different workers run in parallel.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import threading
+
+import incremental
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+    def __reduce__(self):
+        # raised in worker processes and sent back to the server
+        return RpcError, (self.code, str(self))
+
+
+_FILE = {'path': str}
+_METHOD = {'path': str, 'method': str}
+
+# method -> (required parameters, optional parameters), as name -> type
+_PARAMS = {
+    'open': (_FILE, {'text': str}),
+    'edit': ({'path': str, 'start_byte': int, 'old_end_byte': int,
+              'text': str}, {}),
+    'methods': (_FILE, {}),
+    'pretrace': (_METHOD, {}),
+    'must_contain': (_METHOD, {}),
+    'last_calls': (_METHOD, {}),
+    'naive_cat': (_METHOD, {}),
+    'shutdown': ({}, {}),
+}
+
+
+def _validate(name, params):
+    """Raise an RpcError unless `params` are valid for the method `name`."""
+    if name not in _PARAMS:
+        raise RpcError(METHOD_NOT_FOUND, f'unknown method {name!r}')
+    if not isinstance(params, dict):
+        raise RpcError(INVALID_PARAMS, 'parameters must be an object')
+    required, optional = _PARAMS[name]
+    for key in required.keys() - params.keys():
+        raise RpcError(INVALID_PARAMS, f'missing parameter {key!r}')
+    for key, kind in (required | optional).items():
+        value = params.get(key)
+        if key in optional and value is None:
+            continue
+        # bool is a subclass of int, but not a valid byte offset
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise RpcError(INVALID_PARAMS,
+                           f'parameter {key!r} must be of type {kind.__name__}')
+
+
+# State of a worker process: the sessions of its files, and the mtimes of the
+# files they were loaded from, None for unsaved text from `open`/`edit`.
+_sessions = {}
+_mtimes = {}
+_options = {}
+
+
+def _init_worker(options):
+    _options.update(options)
+
+
+def _load(path, text=None):
+    """Create or update the session of `path`; return it."""
+    if text is None:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if path in _sessions and _mtimes.get(path) == mtime:
+                return _sessions[path]
+            with open(path, 'rb') as file:
+                code = file.read()
+        except OSError as e:
+            raise RpcError(INVALID_PARAMS, f'{path}: {e.strerror}')
+    else:
+        mtime, code = None, text.encode('utf-8')
+    if path in _sessions:
+        _sessions[path].replace(code)
+    else:
+        _sessions[path] = incremental.Session(code, **_options)
+    _mtimes[path] = mtime
+    return _sessions[path]
+
+
+def _cached(path):
+    """Return the session of `path`, reloading it if the file changed."""
+    if path in _sessions and _mtimes.get(path) is None:
+        # unsaved text from `open`/`edit` takes precedence over the file
+        return _sessions[path]
+    return _load(path)
+
+
+def _query(name, params):
+    """Answer the validated request `name` in a worker process."""
+    path = params['path']
+    match name:
+        case 'open':
+            return sorted(_load(path, params.get('text')).analysis.pretraces)
+        case 'edit':
+            session = _cached(path)
+            start, end = params['start_byte'], params['old_end_byte']
+            if not 0 <= start <= end <= len(session.source.code):
+                raise RpcError(INVALID_PARAMS,
+                               f'bad byte range {start}..{end}')
+            recomputed = session.edit(start, end,
+                                      params['text'].encode('utf-8'))
+            _mtimes[path] = None
+            return sorted(recomputed)
+        case 'methods':
+            return sorted(_cached(path).analysis.pretraces)
+        case 'naive_cat':
+            cat = _cached(path).analysis.cats.get(params['method'])
+            return None if cat is None else str(cat)
+
+    method = params['method']
+    pretraces = _cached(path).analysis.pretraces
+    if method not in pretraces:
+        raise RpcError(INVALID_PARAMS, f'unknown method {method!r}')
+    pretrace = pretraces[method]
+    match name:
+        case 'pretrace':
+            if pretrace is None:
+                return None
+            return {'regex': str(pretrace.regex),
+                    'simplified': str(pretrace.simplified),
+                    'approximate': pretrace.approximate}
+        case 'must_contain':
+            return sorted(map(str, pretrace.must_contain)) if pretrace else []
+        case 'last_calls':
+            return sorted(map(str, pretrace.last_calls)) if pretrace else []
+
+
+class Server:
+    """
+    The state shared by all connections: the worker processes and the
+    assignment of files to them.
+
+    `options` are passed on to `regex.from_graph`.
+    """
+    def __init__(self, max_workers=None, **options):
+        self.options = options
+        # not forked: the server may already run threads, e.g. _StdioReader
+        context = multiprocessing.get_context('spawn')
+        self.workers = [
+                concurrent.futures.ProcessPoolExecutor(
+                    1, context, initializer=_init_worker, initargs=(options,))
+                for _ in range(max_workers or os.cpu_count() or 1)]
+        # path -> index of its worker
+        self.assigned = {}
+        self.locks = {}
+        self.stopped = asyncio.Event()
+
+    def _worker(self, path):
+        """Return the worker of `path`, assigning the least busy one."""
+        if path not in self.assigned:
+            files = [0] * len(self.workers)
+            for i in self.assigned.values():
+                files[i] += 1
+            self.assigned[path] = files.index(min(files))
+        return self.workers[self.assigned[path]]
+
+    def close(self):
+        for worker in self.workers:
+            worker.shutdown(cancel_futures=True)
+
+    async def handle(self, name, params):
+        _validate(name, params)
+        if name == 'shutdown':
+            self.stopped.set()
+            return None
+        path = params['path']
+        lock = self.locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._worker(path), _query,
+                                              name, params)
+
+    async def _respond(self, line, writer, write_lock):
+        request_id, notification = None, False
+        try:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise RpcError(PARSE_ERROR, str(e))
+            if not isinstance(request, dict) or 'method' not in request:
+                raise RpcError(INVALID_REQUEST, 'not a JSON-RPC request')
+            request_id = request.get('id')
+            notification = 'id' not in request
+            result = await self.handle(request['method'],
+                                       request.get('params', {}))
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+        except RpcError as e:
+            response = {'jsonrpc': '2.0', 'id': request_id,
+                        'error': {'code': e.code, 'message': str(e)}}
+        except Exception as e:
+            response = {'jsonrpc': '2.0', 'id': request_id,
+                        'error': {'code': INTERNAL_ERROR, 'message': repr(e)}}
+        if notification:
+            return
+        async with write_lock:
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    async def serve(self, reader, writer):
+        """Answer the requests read from `reader` until EOF or shutdown."""
+        write_lock = asyncio.Lock()
+        tasks = set()
+        stopped = asyncio.create_task(self.stopped.wait())
+        while True:
+            read = asyncio.create_task(reader.readline())
+            await asyncio.wait((read, stopped),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not read.done():
+                read.cancel()
+                break
+            line = read.result()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.create_task(self._respond(line, writer, write_lock))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        stopped.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+
+class _StdioReader:
+    """
+    Reads lines from stdin, which may be a pipe, terminal or file. A daemon
+    thread does the blocking reads so that it can't delay shutdown.
+    """
+    def __init__(self):
+        loop = asyncio.get_running_loop()
+        self.lines = asyncio.Queue()
+        def put(line):
+            loop.call_soon_threadsafe(self.lines.put_nowait, line)
+        def read():
+            # os.read takes no locks that could be held at interpreter exit
+            rest = b''
+            while chunk := os.read(sys.stdin.fileno(), 1 << 16):
+                *lines, rest = (rest + chunk).split(b'\n')
+                for line in lines:
+                    put(line + b'\n')
+            if rest:
+                put(rest)
+            put(b'')
+        threading.Thread(target=read, daemon=True).start()
+
+    async def readline(self):
+        return await self.lines.get()
+
+
+class _StdioWriter:
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+
+    async def drain(self):
+        sys.stdout.buffer.flush()
+
+
+async def serve_stdio(**options):
+    server = Server(**options)
+    try:
+        await server.serve(_StdioReader(), _StdioWriter())
+    finally:
+        server.close()
+
+
+async def serve_socket(path, **options):
+    server = Server(**options)
+    connections = set()
+    async def serve(reader, writer):
+        task = asyncio.current_task()
+        connections.add(task)
+        try:
+            await server.serve(reader, writer)
+        finally:
+            connections.discard(task)
+            writer.close()
+    try:
+        async with await asyncio.start_unix_server(serve, path):
+            await server.stopped.wait()
+            if connections:
+                await asyncio.wait(connections)
+    finally:
+        server.close()
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('--socket', metavar='PATH',
+                           help='listen on a unix socket instead of stdio')
+    argparser.add_argument('--workers', type=int, default=None,
+                           help='number of analysis processes')
+    args = argparser.parse_args(argv)
+    if args.socket is None:
+        asyncio.run(serve_stdio(max_workers=args.workers))
+    else:
+        asyncio.run(serve_socket(args.socket, max_workers=args.workers))
+
+
+if __name__ == '__main__':
+    main()
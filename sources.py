@@ -0,0 +1,48 @@
+"""
+Annotated source files and the programs extracted from them by `parser`.
+
+Kept apart from `parser`, which loads tree-sitter and the Java grammar, so
+that finding source files and unpickling cached programs stay cheap.
+"""
+
+import dataclasses
+import os
+
+import boolexpr
+import jml
+
+
+SOURCE_SUFFIXES = ('.rjava', '.java')
+
+
+@dataclasses.dataclass
+class Program:
+    normal: set[str]
+    ghost_constants: dict[str, boolexpr.Value]
+    # ghost variables are referred to in expressions as Variable(i) and
+    # Old(i), with i their position in `ghosts`
+    ghosts: dict[str, boolexpr.Value]
+    # method name -> contract clauses in source order
+    methods: dict[str, list[jml.ContractClause]]
+    # enclosing method name -> set statements, under None those outside of
+    # methods and constructors, e.g. in initializer blocks
+    assignments: dict[str | None, list[jml.Assignment]]
+    invariants: list[jml.Invariant]
+    # set statements of each constructor, in source order
+    constructors: list[list[jml.Assignment]] = dataclasses.field(
+            default_factory=list)
+
+
+def source_files(paths):
+    """
+    Yield the files in `paths`, replacing directories by all annotated source
+    files (see SOURCE_SUFFIXES) below them.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                if name.endswith(SOURCE_SUFFIXES):
+                    yield os.path.join(directory, name)
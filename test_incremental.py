@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip('tree_sitter_java')
+
+import incremental
+
+CODE = b"""
+class Door {
+  //@ ghost int state = 0;
+
+  Door(boolean open) {
+    {
+      //@ set state = 1;
+    }
+  }
+
+  //@ requires state == 1;
+  //@ ensures state == 0;
+  void close() {
+    //@ set state = 0;
+  }
+}
+"""
+
+# the constructor may or may not open the door, so there is no single
+# initial state
+CONDITIONAL = CODE.replace(b'    {\n', b'    if (open) {\n')
+
+
+def test_failed_edit_fails_again_when_repeated():
+    session = incremental.Session(CODE)
+    analysis = session.analysis
+    with pytest.raises(ValueError):
+        session.replace(CONDITIONAL)
+    assert session.analysis is analysis
+    # only whitespace changes, so the program is the one that failed
+    with pytest.raises(ValueError):
+        session.replace(CONDITIONAL + b'\n')
+    # back to the program that was analysed last
+    assert session.replace(CODE) == set()
+    assert session.analysis is analysis
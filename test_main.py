@@ -0,0 +1,59 @@
+import io
+import json
+
+import pytest
+
+import main
+
+# the constructor may or may not open the door, so there is no single
+# initial state
+CONDITIONAL_CONSTRUCTOR = b"""
+class Door {
+  //@ ghost int state = 0;
+
+  Door(boolean open) {
+    if (open) {
+      //@ set state = 1;
+    }
+  }
+
+  //@ requires state == 0;
+  //@ ensures state == 1;
+  void open() {
+    //@ set state = 1;
+  }
+}
+"""
+
+UNCONDITIONAL_CONSTRUCTOR = CONDITIONAL_CONSTRUCTOR.replace(
+        b'if (open) {', b'{')
+
+
+@pytest.mark.parametrize('stage, cache', [('model', False), ('regex', True)])
+def test_input_without_model_does_not_stop_the_others(
+        tmp_path, capsys, stage, cache):
+    pytest.importorskip('tree_sitter_java')
+    bad = tmp_path / 'Bad.java'
+    good = tmp_path / 'Good.java'
+    bad.write_bytes(CONDITIONAL_CONSTRUCTOR)
+    good.write_bytes(UNCONDITIONAL_CONSTRUCTOR)
+    argv = ['--format', 'jsonl', stage, str(bad), str(good)]
+    if cache:
+        argv[:0] = ['--cache', str(tmp_path / 'cache')]
+    main.main(argv)
+    records = [json.loads(line)
+               for line in capsys.readouterr().out.splitlines()]
+    assert records[0]['input'] == str(bad)
+    assert 'different states' in records[0]['error']
+    assert all(r['input'] == str(good) and 'error' not in r
+               for r in records[1:])
+    assert len(records) > 1
+
+
+def test_run_writes_the_error_of_an_input_without_model():
+    file = io.StringIO()
+    main.run('regex', 'Bad.java', None, None, main._Output(True, file),
+             error='no single initial state')
+    assert json.loads(file.getvalue()) == {
+            'input': 'Bad.java', 'stage': 'regex',
+            'error': 'no single initial state'}
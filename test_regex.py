@@ -0,0 +1,7 @@
+import regex
+
+
+def test_approximation_is_hashable():
+    a = regex.Approximation(1, 2, 3, regex.terminal('x'))
+    assert hash(a) == hash(regex.Approximation(1, 2, 3, regex.terminal('x')))
+    assert {a: 1}[regex.Approximation(1, 2, 3, regex.terminal('x'))] == 1
@@ -0,0 +1,75 @@
+"""
+Shortest witness traces: for every state and method, a shortest call
+sequence from the initial state that reaches the state or after which the
+method may be called.
+
+One breadth-first search from the initial state records the parent of every
+state and, for every method, the first (so, nearest) state where it may be
+called. Each query then follows parent pointers, in time linear in the length
+of the witness.
+"""
+
+import collections
+
+
+class Witnesses:
+    """Shortest witnesses in the graph `g` from `initial_state`."""
+    def __init__(self, g, initial_state):
+        self.graph = g
+        self.initial_state = initial_state
+        # state -> (parent state, method), None for the initial state
+        self.parents = {initial_state: None}
+        # method -> nearest state where it may be called
+        self.nearest = {}
+        queue = collections.deque((initial_state,))
+        while queue:
+            state = queue.popleft()
+            transitions = g.get(state, {})
+            for method, posts in transitions.items():
+                self.nearest.setdefault(method, state)
+                for post in posts:
+                    if post not in self.parents:
+                        self.parents[post] = (state, method)
+                        queue.append(post)
+
+    def reachable(self, state) -> bool:
+        return state in self.parents
+
+    def path(self, state) -> tuple | None:
+        """
+        Return a shortest call sequence leading from the initial state to
+        `state`, or None if `state` is unreachable.
+        """
+        if state not in self.parents:
+            return None
+        result = []
+        while (parent := self.parents[state]) is not None:
+            state, method = parent
+            result.append(method)
+        result.reverse()
+        return tuple(result)
+
+    def witness(self, method, state=None) -> tuple | None:
+        """
+        Return a shortest call sequence after which `method` may be called,
+        in `state` if given, or None if there is none.
+        """
+        if state is None:
+            state = self.nearest.get(method)
+            if state is None:
+                return None
+        elif method not in self.graph.get(state, {}):
+            return None
+        return self.path(state)
+
+    def prestate_witnesses(self, method) -> dict:
+        """
+        Return the reachable prestates of `method` mapped to their shortest
+        witnesses.
+        """
+        return {state: self.path(state) for state in self.parents
+                if method in self.graph.get(state, {})}
+
+    def uncallable(self, methods) -> list:
+        """Return the `methods` that can never be called."""
+        return [method for method in methods if method not in self.nearest]